@@ -1,48 +1,279 @@
 """
 不動産市場把握AI - Business Analyzer
 Uses Google Gemini 2.0 Flash to analyze crawled website content and extract business details.
+With a SiteManifest, a site whose combined content is unchanged since the
+last analysis gets the stored result back without calling Gemini.
+Calls go through a shared, rate-limited GeminiClient (llm_client.py), and
+with an LLMCache identical content is answered from the result cache.
+
+The prompt text is packed by relevance (prompt_packing.py): boilerplate
+repeated across pages is dropped and the most informative segments fill
+the budget. Sites far larger than one prompt are analyzed in chunked mode:
+the pages are packed into token-budgeted chunks, each chunk is extracted
+concurrently (still under the client's rate limit) and the partial results
+are merged deterministically, with locations normalized against the
+municipality master so branches listed on several pages appear once.
+
+Replies are parsed with json_stream.py, so a reply that is cut off or
+turns invalid still yields the fields that were complete ("partial":
+true, not stored). With on_field, a single-prompt analysis streams the
+reply and reports each field as soon as it closes.
 """
 
-import json
 import os
-import google.generativeai as genai
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_cache import cache_key
+from json_stream import IncrementalJSONParser
+from llm_client import CHARS_PER_TOKEN, GeminiClient, StreamInterrupted
+from municipal_stats import get_default_store
+from prompt_packing import clean_pages, pack_pages
+from site_manifest import content_hash, site_key
+
+# Bump when the prompts in _build_prompt change, so cached results are not reused
+PROMPT_TEMPLATE_VERSION = 1
+GENERATION_CONFIG = {'temperature': 0.3, 'max_output_tokens': 2000}
+
+# Single-prompt mode sends at most this much text
+COMBINED_LIMIT = 15000
+# Above this much boilerplate-free text, chunked mode is used instead of packing
+CHUNKED_THRESHOLD = 3 * COMBINED_LIMIT
+# Chunked mode: text per chunk and the most chunks one analysis may use
+CHUNK_TOKENS = 6000
+CHUNK_CHARS = CHUNK_TOKENS * CHARS_PER_TOKEN
+MAX_CHUNKS = 12
+
+# Chunk extractions run here; GeminiClient still caps in-flight calls
+CHUNK_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix='chunk')
+
+# Lower rank wins when the same area is listed with different types
+LOCATION_TYPE_RANKS = [('本社', 0), ('本店', 0), ('支社', 1), ('支店', 1), ('営業所', 2)]
+
+
+def location_type_rank(location_type):
+    return next((rank for name, rank in LOCATION_TYPE_RANKS if name in (location_type or '')), 3)
+
+
+def merge_partials(partials, store=None):
+    """Merge per-chunk analysis results (in chunk order) into one result.
+
+    Company fields take the first non-empty value, keywords are unioned,
+    is_real_estate is true if any chunk says so. Locations are deduplicated
+    by municipality code (or cleaned-up text when the master does not know
+    the area), keeping the highest-ranked type, and ordered 本社 first.
+    """
+    company = {}
+    keywords = []
+    for partial in partials:
+        for field, value in (partial.get('company') or {}).items():
+            if field == 'keywords':
+                for keyword in value if isinstance(value, list) else []:
+                    if keyword and keyword not in keywords:
+                        keywords.append(keyword)
+            elif field == 'is_real_estate':
+                company[field] = bool(company.get(field)) or value is True
+            elif value not in (None, '', []) and not company.get(field):
+                company[field] = value
+    company['keywords'] = keywords
+
+    merged = {}
+    for partial in partials:
+        for location in partial.get('locations') or []:
+            if not isinstance(location, dict):
+                continue
+            prefecture = (location.get('prefecture') or '').strip()
+            city = (location.get('city') or '').strip()
+            if not prefecture and not city:
+                continue
+            code = store.normalize(prefecture, city) if store else None
+            if code is not None:
+                key = code
+                prefecture = store.by_code[code]['prefecture']
+                city = store.by_code[code]['city']
+            else:
+                key = (''.join(prefecture.split()), ''.join(city.split()))
+            entry = {'prefecture': prefecture, 'city': city, 'type': location.get('type') or ''}
+            if key not in merged:
+                merged[key] = entry
+            elif location_type_rank(entry['type']) < location_type_rank(merged[key]['type']):
+                merged[key]['type'] = entry['type']
+    locations = sorted(merged.values(), key=lambda l: location_type_rank(l['type']))
+
+    # Main location: the head office if one was found, else the first chunk's answer
+    main = None
+    if locations and location_type_rank(locations[0]['type']) == 0:
+        main = locations[0]
+    if main is None:
+        main = next((p['location'] for p in partials
+                     if isinstance(p.get('location'), dict) and p['location'].get('prefecture')), None)
+    if main is None and locations:
+        main = locations[0]
+    main = main or {'prefecture': '不明', 'city': '不明'}
+
+    return {
+        'company': company,
+        'locations': locations,
+        'location': {'prefecture': main.get('prefecture', ''), 'city': main.get('city', '')},
+    }
 
 
 class BusinessAnalyzer:
-    def __init__(self, api_key=''):
-        # Argument takes precedence, otherwise env var
+    def __init__(self, api_key='', manifest=None, llm=None, cache=None, store=None):
+        # Shared client takes precedence, then the argument, then the env var
         key = api_key or os.environ.get('GEMINI_API_KEY', '')
-        self.client = None
-        if key:
-            genai.configure(api_key=key)
-            self.client = genai.GenerativeModel('gemini-2.0-flash')
+        self.manifest = manifest
+        self.cache = cache
+        self.store = store      # municipality master for merging chunk locations
+        self.fell_back = False  # set when the result is a fallback or incomplete (not stored)
+        self.last_call = None   # call_info of the last Gemini call (queue wait etc.)
+        self.last_run = None    # LLM calls and latency of the whole analysis
+        self.packing = None     # prompt_packing stats of the last _combine_pages
+        self.llm = llm
+        if self.llm is None and key:
+            self.llm = GeminiClient(key)
+
+    def analyze(self, url, pages, refresh=False, chunked=None, on_field=None):
+        """Analyze crawled pages to extract business information.
 
-    def analyze(self, url, pages):
-        """Analyze crawled pages to extract business information."""
+        refresh=True forces a new Gemini call (bypasses the manifest reuse
+        and the result cache; the fresh result replaces the cached one).
+        chunked=None picks chunked mode when the boilerplate-free text
+        exceeds CHUNKED_THRESHOLD; True / False force it on or off.
+        on_field(path, value) is called for each field of the reply as soon
+        as it has streamed in (single-prompt Gemini calls only; cached and
+        chunked results arrive only as the return value).
+        """
         # Combine all page text
         combined_text = self._combine_pages(pages)
 
-        if not self.client:
+        if not self.llm:
             # Fallback: basic text analysis without AI
             return self._basic_analysis(url, pages, combined_text)
 
-        return self._ai_analysis(url, combined_text)
+        if chunked is None:
+            chunked = self.packing['clean_chars'] > CHUNKED_THRESHOLD
+        analysis_text = self._combine_pages(pages, limit=None) if chunked else combined_text
+
+        key = self._analysis_key(analysis_text, chunked)
+        if self.manifest is None:
+            return self._finish(*self._cached_ai_analysis(url, pages, analysis_text, key, chunked,
+                                                          refresh, on_field))
+
+        # Same content, prompt and model as the last analysis of this site: reuse it
+        domain = site_key(url)
+        combined_hash = content_hash(analysis_text)
+        previous, analyzed_at, content_changed = self.manifest.load_analysis(domain, combined_hash, key)
+        if previous and not refresh:
+            previous['content_changed'] = False
+            return self._finish(previous, analyzed_at)
+
+        result, cached_at = self._cached_ai_analysis(url, pages, analysis_text, key, chunked,
+                                                     refresh, on_field)
+        if not self.fell_back:
+            self.manifest.save_analysis(domain, combined_hash, key, result, cached_at)
+        result['content_changed'] = content_changed
+        return self._finish(result, cached_at)
+
+    def _analysis_key(self, analysis_text, chunked=False):
+        """cache_key of the analysis: model, prompt template version, config and text."""
+        if chunked:
+            return cache_key(self.llm.model_name, f'{PROMPT_TEMPLATE_VERSION}/chunked', analysis_text,
+                             dict(GENERATION_CONFIG, chunk_tokens=CHUNK_TOKENS, max_chunks=MAX_CHUNKS))
+        return cache_key(self.llm.model_name, PROMPT_TEMPLATE_VERSION, analysis_text, GENERATION_CONFIG)
+
+    def _cached_ai_analysis(self, url, pages, analysis_text, key, chunked=False, refresh=False,
+                            on_field=None):
+        """Single or chunked analysis through the result cache. Returns (result, cached_at or None)."""
+        if chunked:
+            run = lambda: self._chunked_analysis(url, pages)
+        else:
+            run = lambda: self._ai_analysis(url, analysis_text, on_field)
+
+        if self.cache is None:
+            return run(), None
+        if refresh:
+            self.cache.count_bypass()
+        else:
+            hit = self.cache.get(key)
+            if hit:
+                return hit
+
+        result = run()
+        if not self.fell_back:
+            self.cache.put(key, self.llm.model_name, result)
+        return result, None
+
+    def _finish(self, result, cached_at=None):
+        """Mark where the result came from (manifest / cache hit or Gemini calls)."""
+        result['cached'] = cached_at is not None
+        if cached_at is not None:
+            result['cached_at'] = cached_at
+            return result
+        if self.last_call:
+            result['llm_call'] = self.last_call
+        if self.last_run:
+            result['llm_run'] = self.last_run
+        if self.packing:
+            result['prompt_packing'] = self.packing
+        return result
 
-    def _combine_pages(self, pages):
-        """Combine text from all crawled pages."""
-        parts = []
+    def _combine_pages(self, pages, limit=COMBINED_LIMIT):
+        """Combine crawled pages into at most limit characters, most informative first.
+
+        limit=None returns all boilerplate-free text.
+        """
+        text, self.packing = pack_pages(pages, limit)
+        return text
+
+    def _chunk_pages(self, pages, max_chars=CHUNK_CHARS):
+        """Pack pages into chunks of at most max_chars, splitting on page boundaries.
+
+        A page longer than max_chars is split on line boundaries (lines
+        longer than that are cut), each piece keeping the page title.
+        """
+        sections = []
         for page in pages:
-            title = page.get('title', '')
-            text = page.get('text', '')
-            parts.append(f"=== {title} ===\n{text}")
-        combined = '\n\n'.join(parts)
-        # Truncate to fit within token limits
-        return combined[:15000]
+            header = f"=== {page.get('title', '')} ===\n"
+            budget = max(1, max_chars - len(header))
+            body = []
+            size = 0
+            for line in page.get('text', '').split('\n'):
+                while len(line) > budget:
+                    if body:
+                        sections.append(header + '\n'.join(body))
+                        body, size = [], 0
+                    sections.append(header + line[:budget])
+                    line = line[budget:]
+                if body and size + 1 + len(line) > budget:
+                    sections.append(header + '\n'.join(body))
+                    body, size = [], 0
+                size += len(line) + (1 if body else 0)
+                body.append(line)
+            sections.append(header + '\n'.join(body))
 
-    def _ai_analysis(self, url, combined_text):
-        """Use Gemini to analyze business content."""
-        prompt = f"""以下は企業Webサイト（{url}）からクロールしたテキストです。
-この企業について詳細に分析して、以下のJSON形式で回答してください。
+        chunks = []
+        current = ''
+        for section in sections:
+            if current and len(current) + 2 + len(section) > max_chars:
+                chunks.append(current)
+                current = ''
+            current = f"{current}\n\n{section}" if current else section
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def _build_prompt(self, url, text, part=None):
+        """Analysis prompt; part=(index, total) asks for facts from one chunk only."""
+        if part is None:
+            intro = f"""以下は企業Webサイト（{url}）からクロールしたテキストです。
+この企業について詳細に分析して、以下のJSON形式で回答してください。"""
+        else:
+            intro = f"""以下は企業Webサイト（{url}）からクロールしたテキストの一部（{part[0]}/{part[1]}）です。
+このテキストに書かれている事実だけを以下のJSON形式で抽出してください。
+記載のない項目は空文字列・空配列にしてください。locations には記載されている本社・支店・営業所をすべて含めてください。"""
+
+        return f"""{intro}
 
 **重要**: 必ず有効なJSONのみを返してください。マークダウンや説明文は不要です。
 
@@ -72,37 +303,129 @@ class BusinessAnalyzer:
 }}
 
 --- 企業サイトのテキスト ---
-{combined_text}
+{text}
 """
 
+    def _generate_json(self, prompt, on_field=None):
+        """One Gemini call parsed as JSON. Returns (result, call_info).
+
+        With on_field the reply is streamed and on_field(path, value) called
+        as fields complete. A reply that is cut off or invalid part-way
+        returns the recovered fields with result['partial'] = True; one
+        without any JSON raises ValueError.
+        """
+        parser = IncrementalJSONParser()
+        if on_field is None:
+            response, call_info = self.llm.generate(prompt, **GENERATION_CONFIG)
+            content = response.text
+            parser.feed(content)
+        else:
+            started = time.monotonic()
+            chunks = []
+            first_field = []
+
+            def on_text(text):
+                chunks.append(text)
+                for path, value in parser.feed(text):
+                    if not first_field:
+                        first_field.append(round((time.monotonic() - started) * 1000))
+                    on_field(path, value)
+
+            try:
+                call_info = self.llm.generate_stream(prompt, on_text, **GENERATION_CONFIG)
+            except StreamInterrupted as e:
+                # Fields already reached the client: finish with what was parsed
+                if not first_field:
+                    raise
+                print(f"[Analyzer] Stream interrupted: {e}")
+                call_info = e.call_info
+            content = ''.join(chunks)
+            call_info = dict(call_info, first_field_ms=first_field[0] if first_field else None)
+
+        result = parser.partial()
+        if not isinstance(result, dict):
+            print(f"[Analyzer] Raw content: {content[:500]}")
+            raise ValueError(str(parser.error or 'no JSON object in response'))
+        if not parser.done:
+            print(f"[Analyzer] Recovered partial JSON ({parser.error or 'reply cut off'})")
+            print(f"[Analyzer] Raw content: {content[-500:]}")
+            result['partial'] = True
+        return result, call_info
+
+    def _ai_analysis(self, url, combined_text, on_field=None):
+        """Use Gemini to analyze business content."""
+        started = time.monotonic()
         try:
-            response = self.client.generate_content(
-                prompt,
-                generation_config=genai.GenerationConfig(
-                    temperature=0.3,
-                    max_output_tokens=2000,
-                )
-            )
-
-            content = response.text.strip()
-            # Remove markdown code block if present
-            if content.startswith('```'):
-                content = content.split('\n', 1)[1] if '\n' in content else content[3:]
-                if content.endswith('```'):
-                    content = content[:-3]
-                content = content.strip()
-
-            result = json.loads(content)
+            result, self.last_call = self._generate_json(self._build_prompt(url, combined_text), on_field)
+            if result.get('partial'):
+                self.fell_back = True
+            self.last_run = {
+                'mode': 'single', 'chunks': 1, 'llm_calls': 1,
+                'attempts': self.last_call['attempts'],
+                'latency_ms': round((time.monotonic() - started) * 1000),
+            }
             return result
 
-        except json.JSONDecodeError as e:
+        except ValueError as e:
             print(f"[Analyzer] JSON parse error: {e}")
-            print(f"[Analyzer] Raw content: {content[:500]}")
+            self.fell_back = True
             return self._basic_analysis(url, [], combined_text)
         except Exception as e:
             print(f"[Analyzer] Gemini API error: {e}")
+            self.fell_back = True
             return self._basic_analysis(url, [], combined_text)
 
+    def _extract_chunk(self, url, chunk, index, total):
+        """Map step for one chunk. Returns (partial result or None, call_info or None)."""
+        try:
+            return self._generate_json(self._build_prompt(url, chunk, part=(index, total)))
+        except Exception as e:
+            print(f"[Analyzer] Chunk {index}/{total} failed: {type(e).__name__}: {e}")
+            return None, None
+
+    def _chunked_analysis(self, url, pages):
+        """Map-reduce analysis: extract every chunk concurrently, then merge."""
+        started = time.monotonic()
+        chunks = self._chunk_pages(clean_pages(pages)[0])
+        dropped = max(0, len(chunks) - MAX_CHUNKS)
+        if dropped:
+            print(f"[Analyzer] {len(chunks)} chunks, analyzing the first {MAX_CHUNKS}")
+            chunks = chunks[:MAX_CHUNKS]
+
+        total = len(chunks)
+        futures = [CHUNK_POOL.submit(self._extract_chunk, url, chunk, i, total)
+                   for i, chunk in enumerate(chunks, 1)]
+        # Collected in chunk order, so the merge does not depend on timing
+        outcomes = [future.result() for future in futures]
+        partials = [result for result, _ in outcomes if isinstance(result, dict)]
+        calls = [info for _, info in outcomes if info]
+
+        self.last_call = None
+        self.last_run = {
+            'mode': 'chunked',
+            'chunks': total,
+            'dropped_chunks': dropped,
+            'failed_chunks': total - len(partials),
+            'llm_calls': total,
+            'attempts': sum(c['attempts'] for c in calls),
+            'queue_wait_ms': sum(c['queue_wait_ms'] for c in calls),
+            'latency_ms': round((time.monotonic() - started) * 1000),
+        }
+        print(f"[Analyzer] Chunked analysis: {total} chunks, {self.last_run['failed_chunks']} failed, "
+              f"{self.last_run['latency_ms']}ms")
+
+        if not partials:
+            self.fell_back = True
+            return self._basic_analysis(url, [], self._combine_pages(pages))
+        if self.store is None:
+            self.store = get_default_store()
+        result = merge_partials(partials, self.store)
+        if len(partials) < total or dropped or any(p.get('partial') for p in partials):
+            # Incomplete: return it, but do not store it as this content's analysis
+            self.fell_back = True
+            result['partial'] = True
+        return result
+
     def _basic_analysis(self, url, pages, combined_text):
         """Fallback analysis without AI - extract what we can from text."""
         from urllib.parse import urlparse
@@ -2,22 +2,80 @@
 不動産市場把握AI - Flask Server
 """
 
+import json
 import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from queue import Queue
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from crawler import WebCrawler
+from http_cache import HttpCache
+from site_manifest import SiteManifest
 from analyzer import BusinessAnalyzer
-from market_data import MarketDataFetcher
+from llm_client import GeminiClient
+from llm_cache import LLMCache
+from market_data import MarketDataFetcher, dedupe_locations, fan_out
+from potential_ranking import SORT_KEYS, get_default_table
+from market_snapshot import MarketSnapshot
+from municipal_stats import get_default_store
+from trade_area import get_default_index as get_trade_area_index
+from upstream_cache import get_default_cache
+from resilience import breaker_states
 
 # Load environment variables from .env
 load_dotenv()
 
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '')
 ESTAT_API_KEY = os.environ.get('ESTAT_API_KEY', '')
+CRAWL_CACHE_PATH = os.environ.get(
+    'CRAWL_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'http_cache.sqlite3')
+)
+
+SITE_MANIFEST_PATH = os.environ.get(
+    'SITE_MANIFEST_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'site_manifest.sqlite3')
+)
+LLM_CACHE_PATH = os.environ.get(
+    'LLM_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'llm_cache.sqlite3')
+)
+CRAWL_PARSE_PROCESSES = int(os.environ.get('CRAWL_PARSE_PROCESSES', '0'))
+
+# Shared on-disk cache for crawled pages (revalidated with ETag/Last-Modified)
+http_cache = HttpCache(CRAWL_CACHE_PATH)
+
+# Per-site page fingerprints and last analysis (incremental re-crawl)
+site_manifest = SiteManifest(SITE_MANIFEST_PATH)
+
+# Optional process pool for HTML parsing, shared by all crawl requests
+parse_pool = ProcessPoolExecutor(max_workers=CRAWL_PARSE_PROCESSES) if CRAWL_PARSE_PROCESSES > 0 else None
+
+# In-memory TTL/LRU cache for e-Stat and tochidai.info responses, shared by
+# every market-data request (concurrent identical misses are coalesced)
+upstream_cache = get_default_cache()
+
+# One Gemini client for the whole process, sized to the API quota
+llm_client = GeminiClient(
+    GEMINI_API_KEY,
+    rpm=int(os.environ.get('GEMINI_RPM', '15')),
+    tpm=int(os.environ.get('GEMINI_TPM', '1000000')),
+    max_concurrency=int(os.environ.get('GEMINI_MAX_CONCURRENCY', '4')),
+) if GEMINI_API_KEY else None
+
+# Analysis results keyed by model + prompt version + content + config
+llm_cache = LLMCache(LLM_CACHE_PATH)
+
+# Nightly nationwide snapshot (market_snapshot.py build); new versions are
+# picked up without a restart
+market_snapshot = MarketSnapshot()
 
 app = Flask(__name__)
-CORS(app)
+# Let cross-origin clients read the deduplication counts on /api/market-data
+CORS(app, expose_headers=['X-Market-Areas', 'X-Fetches-Saved'])
 
 
 @app.route('/api/health', methods=['GET'])
@@ -29,7 +87,12 @@ def health():
         'keys_configured': {
             'gemini': bool(GEMINI_API_KEY),
             'estat': bool(ESTAT_API_KEY)
-        }
+        },
+        'upstream_cache': upstream_cache.stats(),
+        'market_snapshot': market_snapshot.stats(),
+        'circuit_breakers': breaker_states(),
+        'llm': llm_client.stats() if llm_client else None,
+        'llm_cache': dict(llm_cache.stats)
     })
 
 
@@ -43,20 +106,62 @@ def crawl():
         return jsonify({'error': 'URLが必要です'}), 400
 
     try:
-        crawler = WebCrawler(max_pages=20, max_depth=2)
+        crawler = _make_crawler(data)
         pages = crawler.crawl(url)
-        return jsonify({
-            'pages': pages,
-            'total_pages': len(pages),
-            'root_url': url
-        })
+        result = {'pages': pages}
+        result.update(crawler.summary(url))
+        return jsonify(result)
     except Exception as e:
         return jsonify({'error': f'クロール中にエラー: {str(e)}'}), 500
 
 
+@app.route('/api/crawl/stream', methods=['POST'])
+def crawl_stream():
+    """Streaming variant of /api/crawl (NDJSON).
+
+    Emits one {"type": "page", "page": {...}} line per page as soon as it is
+    parsed, followed by a final {"type": "summary", ...} line.
+    """
+    data = request.get_json()
+    url = data.get('url', '')
+
+    if not url:
+        return jsonify({'error': 'URLが必要です'}), 400
+
+    crawler = _make_crawler(data)
+
+    def generate():
+        try:
+            for page in crawler.iter_crawl(url):
+                yield _ndjson({'type': 'page', 'page': page})
+            summary = {'type': 'summary'}
+            summary.update(crawler.summary(url))
+            yield _ndjson(summary)
+        except Exception as e:
+            yield _ndjson({'type': 'error', 'error': f'クロール中にエラー: {str(e)}'})
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def _make_crawler(data):
+    return WebCrawler(max_pages=20, max_depth=2,
+                      stop_when_found=bool(data.get('stop_early', False)),
+                      cache=http_cache, parse_pool=parse_pool, manifest=site_manifest)
+
+
+def _ndjson(record):
+    return json.dumps(record, ensure_ascii=False) + '\n'
+
+
 @app.route('/api/analyze', methods=['POST'])
 def analyze():
-    """Analyze the crawled content with AI to identify business details."""
+    """Analyze the crawled content with AI to identify business details.
+
+    Identical content is answered from the result cache ("cached": true);
+    "refresh": true in the body forces a new analysis. Sites larger than one
+    prompt are analyzed in chunks; "chunked": true / false forces the mode.
+    "llm_run" reports the LLM calls and latency of the analysis.
+    """
     data = request.get_json()
     url = data.get('url', '')
     pages = data.get('pages', [])
@@ -68,16 +173,75 @@ def analyze():
         return jsonify({'error': 'ページデータが必要です'}), 400
 
     try:
-        analyzer = BusinessAnalyzer(api_key=GEMINI_API_KEY)
-        result = analyzer.analyze(url, pages)
+        analyzer = BusinessAnalyzer(manifest=site_manifest, llm=llm_client, cache=llm_cache)
+        chunked = data.get('chunked')
+        result = analyzer.analyze(url, pages, refresh=bool(data.get('refresh', False)),
+                                  chunked=None if chunked is None else bool(chunked))
         return jsonify(result)
     except Exception as e:
         return jsonify({'error': f'分析中にエラー: {str(e)}'}), 500
 
 
+@app.route('/api/analyze/stream', methods=['POST'])
+def analyze_stream():
+    """Streaming variant of /api/analyze (NDJSON).
+
+    Emits {"type": "field", "path": ["company", "name"], "value": ...} lines
+    as each field of the Gemini reply closes (company.*, locations[i],
+    location.*, then the enclosing objects), followed by a final
+    {"type": "result", "result": {...}} line with the same body as
+    /api/analyze. Cached and chunked analyses send only the result line.
+    """
+    data = request.get_json()
+    url = data.get('url', '')
+    pages = data.get('pages', [])
+
+    if not GEMINI_API_KEY:
+        return jsonify({'error': 'Gemini APIキーが設定されていません。server/.env に GEMINI_API_KEY を設定してください。'}), 400
+
+    if not pages:
+        return jsonify({'error': 'ページデータが必要です'}), 400
+
+    events = Queue()
+
+    def on_field(path, value):
+        events.put({'type': 'field', 'path': list(path), 'value': value})
+
+    def run():
+        try:
+            analyzer = BusinessAnalyzer(manifest=site_manifest, llm=llm_client, cache=llm_cache)
+            chunked = data.get('chunked')
+            result = analyzer.analyze(url, pages, refresh=bool(data.get('refresh', False)),
+                                      chunked=None if chunked is None else bool(chunked),
+                                      on_field=on_field)
+            events.put({'type': 'result', 'result': result})
+        except Exception as e:
+            events.put({'type': 'error', 'error': f'分析中にエラー: {str(e)}'})
+        events.put(None)
+
+    # The analysis finishes (and is cached) even if the client disconnects
+    threading.Thread(target=run, daemon=True).start()
+
+    def generate():
+        while True:
+            record = events.get()
+            if record is None:
+                return
+            yield _ndjson(record)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 @app.route('/api/market-data', methods=['POST'])
 def market_data():
-    """Fetch market data for the given locations."""
+    """Fetch market data for the given locations.
+
+    Locations are normalized against the municipality master first, so
+    branches in the same area (名古屋市天白区 / 天白区) are looked up once and
+    the result is copied to each of them. Distinct areas are served from the
+    nationwide snapshot; only areas missing from it are fetched live.
+    X-Market-Areas / X-Fetches-Saved report the deduplication.
+    """
     data = request.get_json()
     locations = data.get('locations', [])
 
@@ -85,16 +249,92 @@ def market_data():
         return jsonify({'error': '所在地情報が必要です'}), 400
 
     try:
-        fetcher = MarketDataFetcher(estat_key=ESTAT_API_KEY)
-        results = []
-        for loc in locations:
-            area_data = fetcher.fetch_all(loc)
-            results.append(area_data)
-        return jsonify(results)
+        distinct, groups = dedupe_locations(locations, get_default_store())
+        results = [market_snapshot.get(location) for location in distinct]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            fetcher = MarketDataFetcher(estat_key=ESTAT_API_KEY, upstream_cache=upstream_cache)
+            fetched = fetcher.fetch_many([distinct[i] for i in missing])
+            for i, result in zip(missing, fetched):
+                results[i] = result
+
+        response = jsonify(fan_out(results, groups, locations))
+        response.headers['X-Market-Areas'] = str(len(distinct))
+        response.headers['X-Fetches-Saved'] = str(len(locations) - len(distinct))
+        return response
     except Exception as e:
         return jsonify({'error': f'市場データ取得エラー: {str(e)}'}), 500
 
 
+@app.route('/api/market-ranking', methods=['GET'])
+def market_ranking():
+    """Rank every municipality by potential (e.g. per-company opportunity).
+
+    Query: sort (per_company, target_households, ...), order (desc/asc),
+    region (中部 etc.), prefecture (repeatable), min_households, limit.
+    """
+    sort = request.args.get('sort', 'per_company')
+    if sort not in SORT_KEYS:
+        return jsonify({'error': f"sortは {', '.join(SORT_KEYS)} のいずれかを指定してください"}), 400
+
+    try:
+        limit = min(int(request.args.get('limit', 50)), 500)
+        min_households = request.args.get('min_households')
+        min_households = int(min_households) if min_households else None
+    except ValueError:
+        return jsonify({'error': 'limit / min_households は整数で指定してください'}), 400
+
+    try:
+        start = time.perf_counter()
+        result = get_default_table().rank(
+            sort=sort,
+            descending=request.args.get('order', 'desc') != 'asc',
+            prefectures=request.args.getlist('prefecture') or None,
+            region=request.args.get('region') or None,
+            min_households=min_households,
+            limit=limit,
+        )
+        result['sort'] = sort
+        result['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': f'ランキング条件が不正です: {str(e)}'}), 400
+
+
+@app.route('/api/trade-area', methods=['GET'])
+def trade_area():
+    """Aggregate market metrics over a trade area around one municipality.
+
+    Query: prefecture, city, and radius_km (municipalities whose centroid is
+    within N km) or mode=adjacent (the municipality and its neighbours).
+    """
+    prefecture = request.args.get('prefecture', '')
+    city = request.args.get('city', '')
+    code = get_default_store().resolve(prefecture, city)
+    if code is None:
+        return jsonify({'error': f'市区町村が見つかりません: {prefecture} {city}'}), 404
+
+    index = get_trade_area_index()
+    if index.size == 0:
+        return jsonify({'error': '市区町村の中心座標データが未登録です（municipal_stats.py centroids）'}), 503
+
+    try:
+        start = time.perf_counter()
+        if request.args.get('mode') == 'adjacent':
+            result = index.adjacent(code)
+        else:
+            radius_km = float(request.args.get('radius_km', 10))
+            if not 0 < radius_km <= 200:
+                return jsonify({'error': 'radius_km は 0〜200 の範囲で指定してください'}), 400
+            result = index.radius(code, radius_km)
+        result['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        return jsonify(result)
+    except KeyError:
+        return jsonify({'error': f'{prefecture} {city} の中心座標が未登録です'}), 404
+    except ValueError:
+        return jsonify({'error': 'radius_km は数値で指定してください'}), 400
+
+
 if __name__ == '__main__':
     print("=" * 50)
     print("不動産市場把握AI Server v1.0.1")
@@ -0,0 +1,66 @@
+"""
+不動産市場把握AI - HTML Extraction Micro-benchmark
+Compares the html_extract backends on a directory of saved pages.
+
+Usage:
+    python bench_extract.py CORPUS_DIR [--repeat N]
+
+CORPUS_DIR holds raw *.html / *.htm files (e.g. saved with `curl -o`);
+they are decoded the same way the crawler decodes downloaded pages.
+"""
+
+import argparse
+import glob
+import os
+import time
+
+from html_extract import BACKENDS, available_backends, detect_encoding
+
+
+def load_corpus(directory):
+    """Read and decode every HTML file in the directory."""
+    docs = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.htm*'))):
+        with open(path, 'rb') as f:
+            body = f.read()
+        docs.append(body.decode(detect_encoding('', body), errors='replace'))
+    return docs
+
+
+def run(docs, backend, repeat):
+    """Best-of-`repeat` wall time for extracting the whole corpus once."""
+    extract = BACKENDS[backend][0]
+    best = None
+    chars = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chars = sum(len(extract(html)[1]) for html in docs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, chars
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark HTML extraction backends')
+    parser.add_argument('corpus', help='directory of saved .html pages')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    docs = load_corpus(args.corpus)
+    if not docs:
+        print(f"No .html files in {args.corpus}")
+        return
+
+    total_bytes = sum(len(d) for d in docs)
+    print(f"Corpus: {len(docs)} pages, {total_bytes / 1024:.0f} KiB, best of {args.repeat}")
+    print(f"{'backend':<12}{'total ms':>10}{'ms/page':>10}{'vs soup':>10}{'text chars':>12}")
+
+    results = {name: run(docs, name, args.repeat) for name in available_backends()}
+    baseline = results['soup'][0]
+    for name, (elapsed, chars) in results.items():
+        print(f"{name:<12}{elapsed * 1000:>10.1f}{elapsed * 1000 / len(docs):>10.2f}"
+              f"{baseline / elapsed:>9.1f}x{chars:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+"""
+不動産市場把握AI - Company Profile Markers
+Text patterns of a company profile (会社概要) and of a postal address,
+shared by the crawler (early stop) and prompt packing (segment scoring).
+Kept free of the crawler's dependencies so the analyzer can import them.
+"""
+
+import re
+
+PROFILE_MARKERS = ['会社概要', '会社案内', '企業情報', '会社情報']
+PROFILE_FIELDS = ['会社名', '商号', '代表', '設立', '資本金', '所在地', '従業員', '許可']
+POSTAL_ADDRESS_RE = re.compile(r'〒\s*\d{3}-?\d{4}\s*[^〒]{0,30}?[都道府県市区町村郡]')
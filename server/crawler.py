@@ -1,23 +1,110 @@
 """
 不動産市場把握AI - Web Crawler
 Crawls a given URL and all internal links (same domain) up to a depth limit.
+Pages are fetched concurrently from a best-first frontier (links are ranked
+like scoreLink() in app.js); with a parse pool, fetch threads hand bodies
+to it and move on, and parsed pages come back through a bounded window of
+in-flight pages. Per-host politeness is enforced with token buckets
+instead of a fixed sleep. robots.txt is honoured, and sitemap.xml (when
+present) seeds the frontier so discovery does not wait on link depth.
+Near-duplicate pages (SimHash) are dropped, and URL patterns that keep
+producing them are demoted in the frontier. With a SiteManifest, pages seen
+on a previous run are revalidated with their stored ETag / Last-Modified and
+reused on 304 instead of being downloaded and parsed again.
 """
 
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Full, Queue
+from urllib.parse import parse_qsl, urljoin, urlparse
+from urllib.robotparser import RobotFileParser
+import xml.etree.ElementTree as ET
+import gzip
+import heapq
 import re
-import time
+import threading
+
+from company_profile import POSTAL_ADDRESS_RE, PROFILE_FIELDS, PROFILE_MARKERS
+from html_extract import get_extractor, parse_document
+from http_cache import CachedSession
+from ratelimit import HostThrottle
+from simhash import SimHashIndex, simhash
+from site_manifest import content_hash, site_key
+
+
+# Keywords that mark important sub-pages (kept in sync with app.js)
+IMPORTANT_PATH_KEYWORDS = [
+    'company', 'about', 'corporate', 'profile', 'access', 'overview',
+    'summary', 'gaiyou', 'kaisya', 'info', 'office',
+    '会社概要', '会社案内', '企業情報', '事業所', 'greeting'
+]
+
+# Bonus for Japanese link text
+LINK_TEXT_SCORES = [
+    (('会社概要', '会社案内'), 20),
+    (('企業情報', '事業所'), 15),
+    (('アクセス', '所在地'), 15),
+    (('代表挨拶', '社長'), 8),
+    (('事業内容', 'サービス'), 10),
+    (('店舗', '支店'), 10),
+    (('施工事例', '実績'), 5),
+]
+
+
+# _fetch_body() result when a manifest page answered 304 Not Modified
+NOT_MODIFIED = object()
+# _fetch_body() result for 404 / 410: the page is gone from the site
+GONE = object()
 
 
 class WebCrawler:
-    def __init__(self, max_pages=20, max_depth=2, timeout=15):
+    def __init__(self, max_pages=20, max_depth=2, timeout=15,
+                 max_workers=8, per_host_concurrency=4,
+                 per_host_rate=4.0, per_host_burst=4,
+                 stop_when_found=False, use_sitemap=True,
+                 max_sitemap_urls=500, max_child_sitemaps=5, cache=None,
+                 max_page_bytes=1024 * 1024, detect_bytes=32 * 1024,
+                 parser='auto', parse_pool=None, max_in_flight=None,
+                 dedup_threshold=3, duplicate_penalty=15, manifest=None):
         self.max_pages = max_pages
         self.max_depth = max_depth
         self.timeout = timeout
+        self.max_page_bytes = max_page_bytes  # download cap per page
+        self.detect_bytes = detect_bytes      # prefix used for charset sniffing
+        self.extract = get_extractor(parser)  # html -> (title, text, links)
+        self.parse_pool = parse_pool          # optional ProcessPoolExecutor
+        # Pages fetched or being parsed at once (bounds bodies held in memory)
+        self.max_in_flight = max_in_flight or 2 * max_workers
+        # Near-duplicate detection: max SimHash Hamming distance (None = off)
+        self.fingerprints = SimHashIndex(dedup_threshold) if dedup_threshold is not None else None
+        self.duplicate_penalty = duplicate_penalty
+        self.duplicates = 0
+        self.pattern_duplicates = Counter()
+        self._link_scores = {}
+        # Incremental re-crawl (see site_manifest.py)
+        self.manifest = manifest
+        self.known = {}
+        self.gone = set()       # manifest pages that now answer 404 / 410
+        self.changes = Counter()
+        self._manifest_entries = {}
+        self.stop_when_found = stop_when_found
+        self.found_profile = False
+        self.found_address = False
+        self.stopped_early = False
+        self.use_sitemap = use_sitemap
+        self.max_sitemap_urls = max_sitemap_urls
+        self.max_child_sitemaps = max_child_sitemaps
+        self.robots = None
+        self.sitemap_urls = 0
+        self.max_workers = max_workers
+        self.throttle = HostThrottle(rate=per_host_rate, burst=per_host_burst,
+                                     concurrency=per_host_concurrency)
         self.visited = set()
         self.pages = []
-        self.session = requests.Session()
+        self.page_count = 0
+        # With an HttpCache, every GET (pages, robots.txt, sitemaps) is cached
+        self.session = CachedSession(cache) if cache is not None else requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
                           'AppleWebKit/537.36 (KHTML, like Gecko) '
@@ -26,88 +113,439 @@ class WebCrawler:
 
     def crawl(self, start_url):
         """Crawl starting from the given URL."""
+        self.pages = list(self.iter_crawl(start_url))
+        return self.pages
+
+    def iter_crawl(self, start_url):
+        """Crawl starting from the given URL, yielding each page as soon as it is parsed.
+
+        Pages are not kept by the generator itself, so a streaming consumer
+        holds at most one batch in memory.
+        """
         parsed = urlparse(start_url)
         self.base_domain = parsed.netloc
-        self._crawl_page(start_url, depth=0)
-        return self.pages
+        self.page_count = 0
 
-    def _crawl_page(self, url, depth):
-        """Recursively crawl a page and its internal links."""
-        if len(self.pages) >= self.max_pages:
-            return
-        if depth > self.max_depth:
+        start_url = self._normalize_url(start_url)
+        self.visited.add(start_url)
+        if self._is_non_html(start_url):
             return
 
-        # Normalize URL
-        url = self._normalize_url(url)
-        if url in self.visited:
-            return
+        if self.manifest is not None:
+            self.known = self.manifest.load_pages(site_key(start_url))
+
+        # Best-first frontier of (-score, depth, seq, url). Up to max_in_flight
+        # pages (and no more than the page budget left) are in flight at once:
+        # an I/O worker downloads the body, hands it to the parse pool and
+        # moves on to the next URL. Results are taken from the window in
+        # submission order, so the crawl is deterministic regardless of which
+        # fetch or parse finishes first; each one refills the window from the
+        # frontier it has just expanded.
+        # The start page always goes first.
+        frontier = [(float('-inf'), 0, 0, start_url)]
+        self._seq = 1
+        window = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            sitemap_urls = self._discover(pool, start_url)
+            if not self._allowed(start_url):
+                print(f"[Crawler] Disallowed by robots.txt: {start_url}")
+                return
+            # Sitemap entries are treated as links from the start page
+            for link in sitemap_urls:
+                if self._enqueue(frontier, link, '', depth=1):
+                    self.sitemap_urls += 1
+
+            while window or (frontier and self.page_count < self.max_pages):
+                room = min(self.max_in_flight - len(window),
+                           self.max_pages - self.page_count - len(window))
+                for _, depth, _, url in self._pop_batch(frontier, room):
+                    window.append((url, depth, pool.submit(self._fetch_page, url)))
+
+                url, depth, future = window.popleft()
+                result = self._crawl_page(url, depth, future.result())
+                if result is None:
+                    continue
+                page, links, entry = result
+                if self._is_duplicate(url, page):
+                    continue
+                self.page_count += 1
+                if entry is not None:
+                    self._manifest_entries[url] = entry
+                    self.changes[page['change']] += 1
+                self._update_found(page)
+
+                if depth < self.max_depth:
+                    for link, link_text in links:
+                        self._enqueue(frontier, link, link_text, depth + 1)
+                yield page
+
+                if self.stop_when_found and self.found_profile and self.found_address:
+                    self.stopped_early = bool(frontier or window)
+                    for _, _, pending in window:
+                        pending.cancel()
+                    break
+
+        if self.manifest is not None:
+            # Only pages that were requested again and are gone count as
+            # removed; ones the page budget or early stop left unvisited are
+            # kept for the next run. A crawl that exhausted its frontier saw
+            # every reachable page, so the rest of the manifest is dropped.
+            self.changes['not_seen'] = len(self.gone)
+            complete = not frontier and not window and not self.stopped_early
+            self.manifest.save_pages(site_key(start_url), self._manifest_entries,
+                                     prune=complete, removed=self.gone)
+
+    def summary(self, root_url):
+        """Crawl statistics reported alongside the pages."""
+        return {
+            'total_pages': self.page_count,
+            'root_url': root_url,
+            'stopped_early': self.stopped_early,
+            'sitemap_urls': self.sitemap_urls,
+            'duplicates_skipped': self.duplicates,
+            'changes': self._change_summary(),
+            'cache': self.cache_stats()
+        }
+
+    def _change_summary(self):
+        """New / changed / unchanged page counts versus the manifest, or None."""
+        if self.manifest is None:
+            return None
+        summary = {key: self.changes[key] for key in ('new', 'changed', 'unchanged', 'not_seen')}
+        summary['not_modified'] = self.changes['not_modified']
+        summary['content_changed'] = bool(summary['new'] or summary['changed'] or summary['not_seen'])
+        return summary
+
+    def cache_stats(self):
+        """Hit/miss counters for this crawl, or None when caching is off."""
+        return getattr(self.session, 'stats', None)
+
+    def _enqueue(self, frontier, url, link_text, depth):
+        """Push an unseen, robots-allowed URL onto the frontier. Returns True if queued."""
+        if url in self.visited or not self._allowed(url):
+            return False
         self.visited.add(url)
+        score = self._score_link(url, link_text)
+        self._link_scores[url] = score
+        score -= self.duplicate_penalty * self.pattern_duplicates[self._url_pattern(url)]
+        heapq.heappush(frontier, (-score, depth, self._seq, url))
+        self._seq += 1
+        return True
 
-        # Skip non-HTML resources
-        if self._is_non_html(url):
-            return
+    def _pop_batch(self, frontier, size):
+        """Pop up to `size` entries, re-queueing any whose URL pattern was demoted since push."""
+        batch = []
+        while frontier and len(batch) < size:
+            entry = heapq.heappop(frontier)
+            neg_score, depth, seq, url = entry
+            if url in self._link_scores and self.pattern_duplicates:
+                penalty = self.duplicate_penalty * self.pattern_duplicates[self._url_pattern(url)]
+                current = -(self._link_scores[url] - penalty)
+                if current > neg_score:
+                    heapq.heappush(frontier, (current, depth, seq, url))
+                    continue
+            batch.append(entry)
+        return batch
 
+    # =========================================
+    # NEAR-DUPLICATE DETECTION
+    # =========================================
+    def _is_duplicate(self, url, page):
+        """Check the page against earlier ones; record it if it is new."""
+        if self.fingerprints is None:
+            return False
+        fingerprint = simhash(page['text'])
+        match = self.fingerprints.find(fingerprint)
+        if match:
+            self.duplicates += 1
+            self.pattern_duplicates[self._url_pattern(url)] += 1
+            print(f"[Crawler] Near-duplicate of {match[1]}: {url}")
+            return True
+        self.fingerprints.add(fingerprint, url)
+        return False
+
+    def _url_pattern(self, url):
+        """Group URLs that are likely the same template, e.g. /works/12.html -> /works/*."""
+        parsed = urlparse(url)
+        segments = [re.sub(r'\d+', '{n}', seg) for seg in parsed.path.split('/') if seg]
+        if len(segments) > 1:
+            pattern = '/' + '/'.join(segments[:-1]) + '/*'
+        else:
+            pattern = '/' + '/'.join(segments)
+        if parsed.query:
+            keys = sorted({key for key, _ in parse_qsl(parsed.query, keep_blank_values=True)})
+            pattern += '?' + '&'.join(keys)
+        return pattern
+
+    # =========================================
+    # ROBOTS.TXT / SITEMAP DISCOVERY
+    # =========================================
+    def _discover(self, pool, start_url):
+        """Load robots.txt and sitemap.xml (in parallel) and return candidate page URLs.
+
+        Returns an empty list when there is no sitemap (or use_sitemap is off,
+        or max_depth is 0: sitemap entries count as depth-1 links), in which
+        case the crawl falls back to plain link-walking.
+        """
+        parsed = urlparse(start_url)
+        root = f"{parsed.scheme}://{parsed.netloc}"
+        default_sitemap = f"{root}/sitemap.xml"
+
+        robots_future = pool.submit(self._fetch_bytes, f"{root}/robots.txt")
+        use_sitemap = self.use_sitemap and self.max_depth >= 1
+        sitemap_future = pool.submit(self._fetch_bytes, default_sitemap) if use_sitemap else None
+
+        robots_body = robots_future.result()
+        if robots_body is not None:
+            self.robots = RobotFileParser()
+            self.robots.parse(robots_body.decode('utf-8', errors='replace').splitlines())
+
+        if sitemap_future is None:
+            return []
+
+        declared = (self.robots.site_maps() if self.robots else None) or []
+        sitemap_bodies = [sitemap_future.result()] if default_sitemap in declared or not declared else []
+        extra = [u for u in declared if u != default_sitemap][:self.max_child_sitemaps]
+        sitemap_bodies.extend(pool.map(self._fetch_bytes, extra))
+
+        urls, children = [], []
+        for body in sitemap_bodies:
+            page_urls, child_urls = self._parse_sitemap(body)
+            urls.extend(page_urls)
+            children.extend(child_urls)
+
+        # Sitemap index: fetch the child sitemaps (one more parallel round)
+        for body in pool.map(self._fetch_bytes, children[:self.max_child_sitemaps]):
+            urls.extend(self._parse_sitemap(body)[0])
+
+        candidates = []
+        seen = set()
+        for url in urls:
+            if len(candidates) >= self.max_sitemap_urls:
+                break
+            if urlparse(url).netloc != self.base_domain:
+                continue
+            url = self._normalize_url(url)
+            if url in seen or self._is_non_html(url):
+                continue
+            seen.add(url)
+            candidates.append(url)
+        return candidates
+
+    def _fetch_bytes(self, url):
+        """Fetch a small auxiliary resource (robots.txt / sitemap). Returns bytes or None."""
         try:
-            resp = self.session.get(url, timeout=self.timeout, allow_redirects=True)
-            content_type = resp.headers.get('Content-Type', '')
-            if 'text/html' not in content_type:
-                return
+            with self.throttle.slot(urlparse(url).netloc):
+                resp = self.session.get(url, timeout=self.timeout, allow_redirects=True)
+            if resp.status_code != 200:
+                return None
+            body = resp.content
+            if body[:2] == b'\x1f\x8b':  # sitemap.xml.gz
+                body = gzip.decompress(body)
+            return body
+        except (requests.RequestException, OSError) as e:
+            print(f"[Crawler] Error fetching {url}: {e}")
+            return None
+
+    def _parse_sitemap(self, body):
+        """Parse a sitemap or sitemap index. Returns (page_urls, child_sitemap_urls)."""
+        if not body:
+            return [], []
+        try:
+            root = ET.fromstring(body)
+        except ET.ParseError:
+            return [], []
+
+        locs = [el.text.strip() for el in root.iter() if el.tag.endswith('loc') and el.text]
+        if root.tag.endswith('sitemapindex'):
+            return [], locs
+        return locs, []
+
+    def _allowed(self, url):
+        """Check robots.txt rules (everything is allowed when there is no robots.txt)."""
+        if self.robots is None:
+            return True
+        return self.robots.can_fetch(self.session.headers.get('User-Agent', '*'), url)
 
-            resp.encoding = resp.apparent_encoding or 'utf-8'
-            soup = BeautifulSoup(resp.text, 'html.parser')
+    def _fetch_page(self, url):
+        """I/O stage, run on a crawler thread: download a page and hand it to the parser.
 
-            # Extract text content
-            text = self._extract_text(soup)
-            title = soup.title.string.strip() if soup.title and soup.title.string else ''
+        Returns (fetched, parsed) or None; parsed is a Future from the parse
+        pool (the thread does not wait for it), the parsed tuple when there
+        is no pool, or None for a 304.
+        """
+        try:
+            fetched = self._fetch_body(url)
+            if fetched is None:
+                return None
+            if fetched is NOT_MODIFIED or fetched is GONE:
+                return fetched, None
+            # Decoding + parsing is CPU-bound: with a parse pool it runs in
+            # another process while this thread fetches the next URL
+            args = (self.extract, fetched[0], fetched[1], self.detect_bytes)
+            if self.parse_pool is not None:
+                return fetched, self.parse_pool.submit(parse_document, *args)
+            return fetched, parse_document(*args)
+        except requests.RequestException as e:
+            print(f"[Crawler] Error fetching {url}: {e}")
+        except Exception as e:
+            print(f"[Crawler] Parse error for {url}: {e}")
+        return None
 
-            # Store page data
-            self.pages.append({
+    def _crawl_page(self, url, depth, fetch_result):
+        """Turn a _fetch_page result into a page (on the consuming thread).
+
+        Returns (page, internal_links, manifest_entry) or None; the entry is
+        None unless a manifest is in use.
+        """
+        if fetch_result is None:
+            return None
+        fetched, parsed = fetch_result
+        if fetched is GONE:
+            if url in self.known:
+                self.gone.add(url)
+            return None
+        try:
+            known = self.known.get(url)
+            if fetched is NOT_MODIFIED:
+                # 304 against the manifest's validators: reuse the stored page
+                title, text, all_links = known['title'], known['text'], known['links']
+                validators = (known['etag'], known['last_modified'])
+            else:
+                validators = fetched[2]
+                if isinstance(parsed, Future):
+                    parsed = parsed.result()
+                title, text, raw_links = parsed
+                text = text[:5000]  # Limit per page
+                all_links = self._extract_internal_links(raw_links, url)
+
+            page = {
                 'url': url,
                 'title': title,
-                'text': text[:5000],  # Limit per page
+                'text': text,
                 'depth': depth
-            })
+            }
 
-            # Find and crawl internal links
-            if depth < self.max_depth:
-                links = self._extract_internal_links(soup, url)
-                for link in links:
-                    if len(self.pages) >= self.max_pages:
-                        break
-                    time.sleep(0.3)  # Polite delay
-                    self._crawl_page(link, depth + 1)
+            entry = None
+            if self.manifest is not None:
+                page['content_hash'] = content_hash(text)
+                if fetched is NOT_MODIFIED:
+                    page['change'] = 'not_modified'
+                elif known is None:
+                    page['change'] = 'new'
+                elif known['content_hash'] == page['content_hash']:
+                    page['change'] = 'unchanged'
+                else:
+                    page['change'] = 'changed'
+                entry = {
+                    'content_hash': page['content_hash'],
+                    'etag': validators[0],
+                    'last_modified': validators[1],
+                    'title': title,
+                    'text': text,
+                    'links': all_links,
+                }
+
+            # Internal links are queued by crawl(), not followed here
+            links = all_links if depth < self.max_depth else []
+            return page, links, entry
 
-        except requests.RequestException as e:
-            print(f"[Crawler] Error fetching {url}: {e}")
         except Exception as e:
             print(f"[Crawler] Parse error for {url}: {e}")
+        return None
+
+    def _fetch_body(self, url):
+        """Download a page as (content_type, body bytes, (etag, last_modified)).
+
+        Returns None if it is not HTML or an error, GONE for 404 / 410, or
+        NOT_MODIFIED when the manifest's validators still match. The body is
+        streamed and cut at max_page_bytes; non-HTML responses are dropped
+        after the headers, without downloading the body.
+        """
+        headers = {}
+        known = self.known.get(url)
+        if known:
+            if known['etag']:
+                headers['If-None-Match'] = known['etag']
+            if known['last_modified']:
+                headers['If-Modified-Since'] = known['last_modified']
 
-    def _extract_text(self, soup):
-        """Extract meaningful text content from HTML."""
-        # Remove scripts, styles, and nav elements
-        for tag in soup.find_all(['script', 'style', 'nav', 'footer', 'noscript', 'iframe']):
-            tag.decompose()
+        with self.throttle.slot(urlparse(url).netloc):
+            resp = self.session.get(url, timeout=self.timeout, allow_redirects=True,
+                                    stream=True, headers=headers)
+            try:
+                if resp.status_code == 304 and known:
+                    return NOT_MODIFIED
+                if resp.status_code in (404, 410):
+                    return GONE
+                if resp.status_code >= 400:
+                    # Error pages would be recorded in the manifest as content
+                    return None
 
-        # Get text and clean it
-        text = soup.get_text(separator='\n')
-        lines = [line.strip() for line in text.splitlines()]
-        lines = [line for line in lines if len(line) > 2]
-        return '\n'.join(lines)
+                content_type = resp.headers.get('Content-Type', '')
+                if 'text/html' not in content_type:
+                    return None
 
-    def _extract_internal_links(self, soup, current_url):
-        """Extract internal links from the page."""
+                chunks = []
+                size = 0
+                for chunk in resp.iter_content(chunk_size=16 * 1024):
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size >= self.max_page_bytes:
+                        break
+                body = b''.join(chunks)[:self.max_page_bytes]
+            finally:
+                resp.close()
+
+        cache = getattr(self.session, 'cache', None)
+        if cache is not None and not getattr(resp, 'from_cache', False):
+            cache.store(url, resp, body)
+
+        return content_type, body, (resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+
+    def _score_link(self, url, text):
+        """Rank a link by how likely it leads to company profile / address info."""
+        score = 0
+        path = urlparse(url).path.lower()
+
+        for keyword in IMPORTANT_PATH_KEYWORDS:
+            if keyword in path:
+                score += 10
+            if keyword in text:
+                score += 5
+
+        for keywords, bonus in LINK_TEXT_SCORES:
+            if any(kw in text for kw in keywords):
+                score += bonus
+
+        # Slightly penalize deep paths
+        if path.count('/') > 4:
+            score -= 3
+
+        return score
+
+    def _update_found(self, page):
+        """Record whether a company profile page / postal address has been seen."""
+        text = page['text']
+        if not self.found_profile:
+            has_marker = any(m in page['title'] or m in text for m in PROFILE_MARKERS)
+            fields = sum(1 for f in PROFILE_FIELDS if f in text)
+            self.found_profile = has_marker and fields >= 2
+        if not self.found_address:
+            self.found_address = bool(POSTAL_ADDRESS_RE.search(text))
+
+    def _extract_internal_links(self, raw_links, current_url):
+        """Resolve (href, link_text) pairs to internal (url, link_text) pairs."""
         links = []
-        for a_tag in soup.find_all('a', href=True):
-            href = a_tag['href']
+        for href, link_text in raw_links:
             full_url = urljoin(current_url, href)
             parsed = urlparse(full_url)
 
             # Only follow same-domain links
             if parsed.netloc == self.base_domain:
                 clean_url = self._normalize_url(full_url)
-                if clean_url not in self.visited and not self._is_non_html(clean_url):
-                    links.append(clean_url)
+                if not self._is_non_html(clean_url):
+                    links.append((clean_url, link_text))
         return links
 
     def _normalize_url(self, url):
@@ -130,3 +568,55 @@ class WebCrawler:
         ]
         lower = url.lower()
         return any(lower.endswith(ext) for ext in non_html_extensions)
+
+
+def crawl_sites(urls, max_sites=4, queue_size=64, **crawler_kwargs):
+    """Crawl several sites concurrently, yielding (root_url, record) as pages arrive.
+
+    Records are {'type': 'page', 'page': {...}}, then one {'type': 'summary', ...}
+    (or {'type': 'error', ...}) per site. Crawler threads hand records over a
+    bounded queue and block when it is full, so memory stays flat no matter
+    how far the fetchers run ahead of the consumer. Pass a shared
+    ProcessPoolExecutor as parse_pool to spread parsing over all cores.
+    """
+    results = Queue(maxsize=queue_size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.5)
+                return True
+            except Full:
+                pass
+        return False
+
+    def worker(url):
+        crawler = WebCrawler(**crawler_kwargs)
+        try:
+            for page in crawler.iter_crawl(url):
+                if not put((url, {'type': 'page', 'page': page})):
+                    return
+            summary = {'type': 'summary'}
+            summary.update(crawler.summary(url))
+            put((url, summary))
+        except Exception as e:
+            put((url, {'type': 'error', 'error': str(e)}))
+        finally:
+            put(done)
+
+    with ThreadPoolExecutor(max_workers=max_sites) as pool:
+        for url in urls:
+            pool.submit(worker, url)
+        try:
+            remaining = len(urls)
+            while remaining:
+                item = results.get()
+                if item is done:
+                    remaining -= 1
+                    continue
+                yield item
+        finally:
+            # Consumer gave up early: let blocked workers exit
+            stop.set()
@@ -0,0 +1,174 @@
+"""
+不動産市場把握AI - e-Stat Fixture Server
+Local stand-in for the e-Stat getStatsData endpoint. Serves full responses
+saved as FIXTURE_DIR/<statsDataId>.json and pages them the way e-Stat does
+(startPosition / limit, RESULT_INF.NEXT_KEY, metaGetFlg=N drops the
+metadata), so estat_ingest.py and MarketDataFetcher can run offline.
+
+Usage:
+    python estat_fixture_server.py FIXTURE_DIR [--port 8799] [--generate]
+
+--generate first writes synthetic fixtures for the ingest tables, one row
+set per municipality in the statistics store. Then:
+    ESTAT_API_BASE=http://127.0.0.1:8799/rest/3.0/app/json python estat_ingest.py
+"""
+
+import argparse
+import copy
+import json
+import os
+import random
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+API_PATH = '/rest/3.0/app/json/getStatsData'
+
+
+def make_page(response, start, limit, with_meta=True):
+    """Slice a full getStatsData response to one page (1-based start)."""
+    page = copy.deepcopy(response)
+    stats = page['GET_STATS_DATA']['STATISTICAL_DATA']
+    values = stats.get('DATA_INF', {}).get('VALUE', [])
+    if not isinstance(values, list):
+        values = [values]
+
+    chunk = values[start - 1:start - 1 + limit]
+    stats['DATA_INF']['VALUE'] = chunk
+    result_inf = {
+        'TOTAL_NUMBER': len(values),
+        'FROM_NUMBER': start,
+        'TO_NUMBER': start + len(chunk) - 1,
+    }
+    if start - 1 + limit < len(values):
+        result_inf['NEXT_KEY'] = start + limit
+    stats['RESULT_INF'] = result_inf
+    if not with_meta:
+        stats.pop('TABLE_INF', None)
+        stats.pop('CLASS_INF', None)
+    return page
+
+
+def error_response(status, message):
+    return {'GET_STATS_DATA': {'RESULT': {'STATUS': status, 'ERROR_MSG': message}}}
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    fixture_dir = '.'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != API_PATH:
+            self.send_error(404)
+            return
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        path = os.path.join(self.fixture_dir, f"{query.get('statsDataId', '')}.json")
+
+        if not os.path.exists(path):
+            body = error_response(100, '指定された統計表が存在しません。')
+        else:
+            with open(path, encoding='utf-8') as f:
+                body = make_page(
+                    json.load(f),
+                    start=int(query.get('startPosition', 1)),
+                    limit=int(query.get('limit', 100000)),
+                    with_meta=query.get('metaGetFlg', 'Y') != 'N',
+                )
+
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        print(f"[EStatFixture] {format % args}")
+
+
+# =========================================
+# SYNTHETIC FIXTURES
+# =========================================
+def _response(stats_data_id, title, class_objs, values):
+    return {'GET_STATS_DATA': {
+        'RESULT': {'STATUS': 0, 'ERROR_MSG': '正常に終了しました。'},
+        'STATISTICAL_DATA': {
+            'RESULT_INF': {},
+            'TABLE_INF': {'@id': stats_data_id, 'STAT_NAME': {'$': title}, 'TITLE': {'$': ''}},
+            'CLASS_INF': {'CLASS_OBJ': class_objs},
+            'DATA_INF': {'VALUE': values},
+        },
+    }}
+
+
+def _class(dim, name, codes):
+    return {'@id': dim, '@name': name,
+            'CLASS': [{'@code': code, '@name': label} for code, label in codes]}
+
+
+def generate_fixtures(directory, store, seed=0):
+    """Write plausible random tables for every municipality in the store."""
+    rng = random.Random(seed)
+    areas = [(code, r['city']) for code, r in sorted(store.by_code.items())]
+    area_class = _class('area', '地域', areas)
+    time_class = _class('time', '時間軸', [('2020000000', '2020年')])
+
+    population, construction, housing = [], [], []
+    for code, _ in areas:
+        people = rng.randint(2000, 400000)
+        population += [
+            {'@tab': '020', '@cat01': '0000', '@area': code, '@time': '2020000000', '$': str(people)},
+            {'@tab': '040', '@cat01': '0000', '@area': code, '@time': '2020000000',
+             '$': str(people * 10 // 23)},
+        ]
+        starts = max(1, people // 120)
+        construction += [
+            {'@cat01': '001', '@area': code, '@time': '2020000000', '$': str(starts)},
+            {'@cat01': '002', '@area': code, '@time': '2020000000', '$': str(starts * 4 // 10)},
+        ]
+        dwellings = people * 10 // 23
+        housing += [
+            {'@cat01': '000', '@area': code, '@time': '2020000000', '$': str(dwellings)},
+            {'@cat01': '010', '@area': code, '@time': '2020000000',
+             '$': str(dwellings * rng.randint(40, 80) // 100)},
+        ]
+
+    tables = {
+        '0003448233': _response('0003448233', '国勢調査', [
+            _class('tab', '表章項目', [('020', '人口'), ('040', '世帯数')]),
+            _class('cat01', '男女', [('0000', '総数')]), area_class, time_class,
+        ], population),
+        '0003426741': _response('0003426741', '建築着工統計調査', [
+            _class('cat01', '利用関係', [('001', '総数'), ('002', '持家')]), area_class, time_class,
+        ], construction),
+        '0003445078': _response('0003445078', '住宅・土地統計調査', [
+            _class('cat01', '所有の関係', [('000', '住宅総数'), ('010', '持ち家')]),
+            area_class, time_class,
+        ], housing),
+    }
+    os.makedirs(directory, exist_ok=True)
+    for stats_data_id, response in tables.items():
+        with open(os.path.join(directory, f'{stats_data_id}.json'), 'w', encoding='utf-8') as f:
+            json.dump(response, f, ensure_ascii=False)
+    print(f"[EStatFixture] Wrote {len(tables)} fixtures for {len(areas)} areas to {directory}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local e-Stat getStatsData stand-in')
+    parser.add_argument('fixtures', help='directory of <statsDataId>.json responses')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8799)
+    parser.add_argument('--generate', action='store_true', help='write synthetic fixtures first')
+    args = parser.parse_args()
+
+    if args.generate:
+        from municipal_stats import get_default_store
+        generate_fixtures(args.fixtures, get_default_store())
+
+    FixtureHandler.fixture_dir = args.fixtures
+    server = ThreadingHTTPServer((args.host, args.port), FixtureHandler)
+    print(f"[EStatFixture] Serving {args.fixtures} on http://{args.host}:{args.port}{API_PATH}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
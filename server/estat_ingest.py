@@ -0,0 +1,524 @@
+"""
+不動産市場把握AI - e-Stat Bulk Ingest
+Offline command that pulls whole e-Stat tables page by page (following
+RESULT_INF.NEXT_KEY), parses each response incrementally instead of
+loading it with resp.json(), and normalizes the rows into a per-municipality
+columnar dataset that is then loaded into the municipality statistics store.
+
+Every page is written to disk before the checkpoint moves on, so an
+interrupted run resumes from the last completed page; a completed table is
+skipped on re-runs unless --force is given.
+
+Layout under --output (default server/data/estat/):
+    <statsDataId>/state.json        checkpoint + table metadata
+    <statsDataId>/page-0001.ndjson  one [area, series, value] row per line
+    <name>.columns.json             columnar dataset (areas x series)
+
+Usage:
+    python estat_ingest.py [--tables population construction housing]
+                           [--force] [--no-load] [--base-url URL]
+
+Point --base-url (or ESTAT_API_BASE) at estat_fixture_server.py to run
+without the real API.
+"""
+
+import argparse
+import codecs
+import glob
+import json
+import os
+import re
+import time
+
+import requests
+
+from market_data import EMPTY_CATEGORY, ESTAT_API_BASE
+from municipal_stats import BASE_DIR, get_default_store
+
+DEFAULT_OUTPUT_DIR = os.path.join(BASE_DIR, 'data', 'estat')
+
+TABLES = {
+    'population': {'statsDataId': '0003448233', 'params': {}},    # 国勢調査 人口等基本集計
+    'construction': {'statsDataId': '0003426741', 'params': {}},  # 建築着工統計調査
+    'housing': {'statsDataId': '0003445078', 'params': {}},       # 住宅・土地統計調査
+}
+
+PAGE_LIMIT = 100000  # e-Stat maximum rows per request
+CHUNK_SIZE = 64 * 1024
+
+# Dimensions that are not part of a series key
+NON_SERIES_DIMS = ('area', 'unit')
+
+# Class names that denote the total of a dimension
+TOTAL_WORDS = ('総数', '総計', '合計')
+
+# (field, keyword) per table: a series feeds the field when one class name
+# contains the keyword and every other (non-time) class name is a total.
+# keyword None selects the all-totals series.
+FIELD_RULES = {
+    'population': [('total_population', '人口'), ('households', '世帯数')],
+    'construction': [('total', None), ('owner_occupied', '持家')],
+    'housing': [('total_dwellings', None), ('owned_dwellings', '持ち家')],
+}
+
+VALUE_KEY_RE = re.compile(r'"VALUE"\s*:\s*')
+META_KEYS = ('RESULT', 'RESULT_INF', 'TABLE_INF', 'CLASS_INF')
+WHITESPACE = ' \t\r\n'
+
+
+class EStatError(Exception):
+    pass
+
+
+# =========================================
+# INCREMENTAL JSON PARSING
+# =========================================
+def iter_stats_data(chunks):
+    """Parse a getStatsData response from an iterable of byte chunks.
+
+    Yields (key, obj): the metadata blocks ('RESULT', 'RESULT_INF',
+    'TABLE_INF', 'CLASS_INF') once the text before DATA_INF.VALUE has
+    arrived, then ('VALUE', row) for each row as soon as it is complete.
+    Only the unparsed tail of the response is held in memory.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buf = ''
+    state = 'meta'
+
+    for chunk in _with_end(chunks):
+        final = chunk is None
+        buf += text_decoder.decode(chunk or b'', final=final)
+
+        if state == 'meta':
+            marker = VALUE_KEY_RE.search(buf)
+            if marker is None:
+                if final:  # error responses and empty tables have no VALUE
+                    yield from _parse_meta(buf, decoder)
+                    return
+                continue
+            yield from _parse_meta(buf[:marker.start()], decoder)
+            buf = buf[marker.end():]
+            state = 'start'
+
+        if state == 'start':
+            buf = buf.lstrip(WHITESPACE)
+            if not buf:
+                continue
+            if buf[0] == '[':
+                buf = buf[1:]
+                state = 'array'
+            else:  # a single row is not wrapped in a list
+                state = 'single'
+
+        if state == 'single':
+            try:
+                row, _ = decoder.raw_decode(buf)
+            except json.JSONDecodeError:
+                if final:
+                    raise EStatError('Truncated response')
+                continue
+            yield 'VALUE', row
+            return
+
+        if state == 'array':
+            pos = 0
+            while True:
+                while pos < len(buf) and buf[pos] in WHITESPACE + ',':
+                    pos += 1
+                if pos >= len(buf):
+                    break
+                if buf[pos] == ']':
+                    return
+                try:
+                    row, pos = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    break  # row continues in the next chunk
+                yield 'VALUE', row
+            buf = buf[pos:]
+            if final:
+                raise EStatError('Truncated response')
+
+
+def _with_end(chunks):
+    yield from chunks
+    yield None
+
+
+def _parse_meta(text, decoder):
+    for key in META_KEYS:
+        match = re.search(rf'"{key}"\s*:\s*', text)
+        if match:
+            obj, _ = decoder.raw_decode(text, match.end())
+            yield key, obj
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def parse_number(value):
+    """e-Stat cell value as int/float; '-', '***', 'x' etc. become None."""
+    text = str(value).replace(',', '').strip()
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+# =========================================
+# FETCH (resumable)
+# =========================================
+class EStatIngest:
+    """Pulls e-Stat tables into page files and builds the columnar dataset."""
+
+    def __init__(self, app_id='', output_dir=DEFAULT_OUTPUT_DIR, base_url=ESTAT_API_BASE,
+                 page_limit=PAGE_LIMIT, timeout=120, retries=3):
+        self.app_id = app_id or os.environ.get('ESTAT_API_KEY', '')
+        self.output_dir = output_dir
+        self.base_url = base_url.rstrip('/')
+        self.page_limit = page_limit
+        self.timeout = timeout
+        self.retries = retries
+        self.session = requests.Session()
+
+    def table_dir(self, stats_data_id):
+        return os.path.join(self.output_dir, stats_data_id)
+
+    def load_state(self, stats_data_id):
+        path = os.path.join(self.table_dir(stats_data_id), 'state.json')
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_state(self, stats_data_id, state):
+        _write_json(os.path.join(self.table_dir(stats_data_id), 'state.json'), state)
+
+    def fetch_table(self, name, force=False):
+        """Download every page of a table, resuming from the last checkpoint."""
+        table = TABLES[name]
+        stats_data_id = table['statsDataId']
+        directory = self.table_dir(stats_data_id)
+
+        state = None if force else self.load_state(stats_data_id)
+        if state and state['complete']:
+            print(f"[EStatIngest] {name} ({stats_data_id}) already complete "
+                  f"({state['rows']} rows), skipping")
+            return state
+        if state is None:
+            for path in glob.glob(os.path.join(directory, 'page-*.ndjson')):
+                os.remove(path)
+            state = {'name': name, 'statsDataId': stats_data_id, 'next_key': 1,
+                     'pages': 0, 'rows': 0, 'total_number': None, 'complete': False,
+                     'title': '', 'classes': {}}
+        else:
+            print(f"[EStatIngest] Resuming {name} ({stats_data_id}) at row {state['next_key']}")
+        os.makedirs(directory, exist_ok=True)
+
+        while not state['complete']:
+            page = state['pages'] + 1
+            started = time.time()
+            rows, result_inf, meta = self._fetch_page_with_retry(
+                table, state['next_key'], os.path.join(directory, f'page-{page:04d}.ndjson'),
+                with_meta=not state['classes'],
+            )
+            if meta:
+                state['title'] = meta['title']
+                state['classes'] = meta['classes']
+
+            next_key = result_inf.get('NEXT_KEY')
+            state.update({
+                'pages': page,
+                'rows': state['rows'] + rows,
+                'total_number': result_inf.get('TOTAL_NUMBER', state['total_number']),
+                'next_key': int(next_key) if next_key else None,
+                'complete': not next_key,
+            })
+            self._save_state(stats_data_id, state)
+            print(f"[EStatIngest] {name} page {page}: {rows} rows "
+                  f"({state['rows']}/{state['total_number'] or '?'}) in {time.time() - started:.1f}s")
+        return state
+
+    def _fetch_page_with_retry(self, table, start, path, with_meta):
+        for attempt in range(1, self.retries + 1):
+            try:
+                return self._fetch_page(table, start, path, with_meta)
+            except (requests.RequestException, EStatError) as e:
+                if attempt == self.retries:
+                    raise
+                print(f"[EStatIngest] Page at {start} failed ({e}), retry {attempt}")
+                time.sleep(2 ** attempt)
+
+    def _fetch_page(self, table, start, path, with_meta):
+        """Stream one page into `path`; returns (rows, RESULT_INF, meta or None)."""
+        params = {
+            'appId': self.app_id,
+            'statsDataId': table['statsDataId'],
+            'startPosition': start,
+            'limit': self.page_limit,
+            'metaGetFlg': 'Y' if with_meta else 'N',
+            'cntGetFlg': 'N',
+        }
+        params.update(table['params'])
+
+        result_inf = {}
+        meta = {'title': '', 'classes': {}} if with_meta else None
+        rows = 0
+        tmp_path = path + '.tmp'
+        with self.session.get(f'{self.base_url}/getStatsData', params=params,
+                              timeout=self.timeout, stream=True) as resp:
+            resp.raise_for_status()
+            with open(tmp_path, 'w', encoding='utf-8') as out:
+                for key, obj in iter_stats_data(resp.iter_content(CHUNK_SIZE)):
+                    if key == 'VALUE':
+                        out.write(json.dumps(_compact_row(obj), ensure_ascii=False) + '\n')
+                        rows += 1
+                    elif key == 'RESULT':
+                        status = int(obj.get('STATUS', 0))
+                        if status >= 100:
+                            raise EStatError(f"STATUS {status}: {obj.get('ERROR_MSG', '')}")
+                    elif key == 'RESULT_INF':
+                        result_inf = obj
+                    elif key == 'TABLE_INF' and meta is not None:
+                        meta['title'] = _table_title(obj)
+                    elif key == 'CLASS_INF' and meta is not None:
+                        meta['classes'] = _class_names(obj)
+        os.replace(tmp_path, path)
+        return rows, result_inf, meta
+
+    # =========================================
+    # NORMALIZE (columnar)
+    # =========================================
+    def build_columns(self, name):
+        """Pivot a fetched table into {areas, series, columns} and write it."""
+        stats_data_id = TABLES[name]['statsDataId']
+        state = self.load_state(stats_data_id)
+        if not state or not state['complete']:
+            raise EStatError(f'{name} ({stats_data_id}) has not been fetched completely')
+
+        classes = state['classes']
+        area_index = {}
+        series_index = {}
+        cells = []
+        for path in sorted(glob.glob(os.path.join(self.table_dir(stats_data_id), 'page-*.ndjson'))):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    area, series, value = json.loads(line)
+                    a = area_index.setdefault(area, len(area_index))
+                    s = series_index.setdefault(series, len(series_index))
+                    cells.append((a, s, value))
+
+        columns = [[None] * len(area_index) for _ in series_index]
+        for a, s, value in cells:
+            columns[s][a] = value
+
+        area_names = classes.get('area', {})
+        dataset = {
+            'name': name,
+            'statsDataId': stats_data_id,
+            'title': state['title'],
+            'built_at': time.time(),
+            'areas': list(area_index),
+            'area_names': [area_names.get(code, '') for code in area_index],
+            'series': [_describe_series(key, classes) for key in series_index],
+            'columns': {key: column for key, column in zip(series_index, columns)},
+        }
+        _write_json(os.path.join(self.output_dir, f'{name}.columns.json'), dataset)
+        print(f"[EStatIngest] {name}: {len(area_index)} areas x {len(series_index)} series")
+        return dataset
+
+    # =========================================
+    # LOAD INTO THE MUNICIPALITY STORE
+    # =========================================
+    def load_into_store(self, name, dataset, store):
+        """Write the fields FIELD_RULES finds in a dataset into the store."""
+        picked = {}
+        for field, keyword in FIELD_RULES[name]:
+            series = _pick_series(dataset['series'], keyword)
+            if series:
+                picked[field] = series
+        if not picked:
+            print(f"[EStatIngest] {name}: no series matched FIELD_RULES, store unchanged")
+            return 0
+
+        prefectures = {r['pref_code']: r['prefecture'] for r in store.by_code.values()}
+        updates = {}
+        for i, (area, area_name) in enumerate(zip(dataset['areas'], dataset['area_names'])):
+            code = _resolve_area(store, prefectures, area, area_name)
+            if code is None:
+                continue
+            values = {field: dataset['columns'][s['key']][i] for field, s in picked.items()}
+            category = _to_category(name, store.by_code[code].get(name), values,
+                                    dataset['title'], next(iter(picked.values())))
+            if category:
+                updates[code] = {name: category}
+
+        store.update_many(updates)
+        fields = ', '.join(f"{field}={series['name']}" for field, series in picked.items())
+        print(f"[EStatIngest] {name}: updated {len(updates)} municipalities ({fields})")
+        return len(updates)
+
+    def run(self, names, force=False, load=True):
+        store = get_default_store() if load else None
+        for name in names:
+            self.fetch_table(name, force=force)
+            dataset = self.build_columns(name)
+            if store is not None:
+                self.load_into_store(name, dataset, store)
+
+
+def _compact_row(row):
+    dims = {k[1:]: v for k, v in row.items() if k.startswith('@')}
+    series = '|'.join(f'{dim}={dims[dim]}' for dim in sorted(dims) if dim not in NON_SERIES_DIMS)
+    return [dims.get('area', ''), series, parse_number(row.get('$', ''))]
+
+
+def _table_title(table_inf):
+    title = table_inf.get('TITLE', '')
+    if isinstance(title, dict):
+        title = title.get('$', '')
+    stat_name = table_inf.get('STAT_NAME', '')
+    if isinstance(stat_name, dict):
+        stat_name = stat_name.get('$', '')
+    return f'{stat_name} {title}'.strip()
+
+
+def _class_names(class_inf):
+    """{dimension id: {code: name}} from CLASS_INF."""
+    classes = {}
+    for obj in _as_list(class_inf.get('CLASS_OBJ')):
+        classes[obj['@id']] = {c['@code']: c.get('@name', '') for c in _as_list(obj.get('CLASS'))}
+    return classes
+
+
+def _describe_series(key, classes):
+    names = []
+    time_code = time_name = None
+    for part in key.split('|') if key else []:
+        dim, code = part.split('=', 1)
+        name = classes.get(dim, {}).get(code, code)
+        if dim == 'time':
+            time_code, time_name = code, name
+        else:
+            names.append(name)
+    return {'key': key, 'name': ' / '.join(names), 'names': names,
+            'time': time_code, 'time_name': time_name}
+
+
+def _pick_series(series_list, keyword):
+    """Latest-time series matching a (keyword, all-other-totals) rule."""
+    matches = []
+    for s in series_list:
+        names = s['names']
+        if keyword is None:
+            if names and all(any(w in n for w in TOTAL_WORDS) for n in names):
+                matches.append((s, 0))
+            continue
+        for i, n in enumerate(names):
+            others = names[:i] + names[i + 1:]
+            if keyword in n and all(any(w in o for w in TOTAL_WORDS) for o in others):
+                matches.append((s, len(n)))
+                break
+    if not matches:
+        return None
+    # Newest period first, then the most specific name, then key order
+    matches.sort(key=lambda m: m[0]['key'])
+    matches.sort(key=lambda m: m[1])
+    matches.sort(key=lambda m: m[0]['time'] or '', reverse=True)
+    return matches[0][0]
+
+
+def _resolve_area(store, prefectures, area, area_name):
+    """Store code for an e-Stat area: by code, else by (prefecture, name)."""
+    if area in store.by_code:
+        return area
+    prefecture = prefectures.get(area[:2])
+    if prefecture is None or not area_name:
+        return None
+    city = ''.join(area_name.split())
+    if city.startswith(prefecture):
+        city = city[len(prefecture):]
+    return store.resolve(prefecture, city)
+
+
+# Category keys that describe the data rather than hold a statistic
+META_FIELDS = ('source', 'year', 'field_sources')
+
+
+def _to_category(name, existing, values, title, series):
+    """Merge ingested values into the stored category.
+
+    Only cells the table actually has (not None) are written; other fields
+    keep their stored value. field_sources records where each field came
+    from, and source lists every provenance still present in the category.
+    """
+    if name == 'housing':
+        owned, total = values.get('owned_dwellings'), values.get('total_dwellings')
+        values = {'ownership_rate': round(owned / total * 100, 1) if owned and total else None}
+    values = {field: value for field, value in values.items() if value is not None}
+    if not values:
+        return None
+
+    data = dict(EMPTY_CATEGORY[name])
+    data.update(existing or {})
+    period = series.get('time_name') or ''
+    provenance = f'e-Stat {title} ({period})' if period else f'e-Stat {title}'
+
+    # Fields stored before per-field tracking carry the category's old source
+    legacy = (existing or {}).get('source')
+    field_sources = dict(data.get('field_sources') or {})
+    for field, value in data.items():
+        if field not in META_FIELDS and value is not None and field not in field_sources and legacy:
+            field_sources[field] = legacy
+    data.update(values)
+    field_sources.update({field: provenance for field in values})
+
+    if name == 'construction':
+        data['year'] = period or data.get('year')
+    sources = []
+    for field, value in data.items():
+        source = field_sources.get(field)
+        if field not in META_FIELDS and value is not None and source and source not in sources:
+            sources.append(source)
+    data['field_sources'] = {field: source for field, source in field_sources.items()
+                             if data.get(field) is not None}
+    data['source'] = ' / '.join(sources) or provenance
+    return data
+
+
+def _write_json(path, data):
+    """Write JSON atomically (temp file + rename) so a crash never leaves half a file."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk-ingest e-Stat tables')
+    parser.add_argument('--tables', nargs='+', choices=list(TABLES), default=list(TABLES))
+    parser.add_argument('--output', default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument('--base-url', default=ESTAT_API_BASE)
+    parser.add_argument('--limit', type=int, default=PAGE_LIMIT, help='rows per request')
+    parser.add_argument('--force', action='store_true', help='refetch completed tables')
+    parser.add_argument('--no-load', action='store_true', help='do not update the municipality store')
+    args = parser.parse_args()
+
+    ingest = EStatIngest(output_dir=args.output, base_url=args.base_url, page_limit=args.limit)
+    if not ingest.app_id:
+        print('[EStatIngest] ESTAT_API_KEY is not set')
+    ingest.run(args.tables, force=args.force, load=not args.no_load)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+不動産市場把握AI - HTML Extraction Backends
+Charset detection and single-pass extraction of (title, text, links) from
+an HTML document. Everything here is a plain module-level function so it can
+run in a worker process (see WebCrawler(parse_pool=...)).
+
+Backends:
+  - 'selectolax'  fastest, needs `pip install selectolax`
+  - 'lxml'        fast, needs `pip install lxml`
+  - 'soup'        BeautifulSoup + html.parser (always available, fallback)
+
+'auto' picks the fastest one that is installed.
+"""
+
+import codecs
+import re
+
+from bs4 import BeautifulSoup
+from requests.compat import chardet
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as SelectolaxParser
+except ImportError:
+    SelectolaxParser = None
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+
+# Elements whose text is not page content
+SKIP_TAGS = ['script', 'style', 'nav', 'footer', 'noscript', 'iframe']
+
+# Anchor text is only used for link scoring
+LINK_TEXT_LIMIT = 50
+
+# Charset declarations (HTTP header / <meta charset> / http-equiv)
+HEADER_CHARSET_RE = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.I)
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.I)
+
+# Declared Japanese charsets are usually the Windows supersets in practice
+CHARSET_ALIASES = {
+    'shift_jis': 'cp932', 'shift-jis': 'cp932', 'sjis': 'cp932',
+    'x-sjis': 'cp932', 'windows-31j': 'cp932',
+    'euc-jp': 'euc_jis_2004', 'x-euc-jp': 'euc_jis_2004',
+}
+
+
+# =========================================
+# DECODING
+# =========================================
+def detect_encoding(content_type, body, detect_bytes=32 * 1024):
+    """Pick a codec: HTTP header, then <meta charset>, then sniff a bounded prefix."""
+    declared = HEADER_CHARSET_RE.search(content_type)
+    if not declared:
+        declared = META_CHARSET_RE.search(body[:4096])
+    if declared:
+        name = declared.group(1)
+        if isinstance(name, bytes):
+            name = name.decode('ascii', errors='ignore')
+        encoding = lookup_codec(name)
+        if encoding:
+            return encoding
+
+    detected = chardet.detect(body[:detect_bytes]).get('encoding') if body else None
+    return lookup_codec(detected) or 'utf-8'
+
+
+def lookup_codec(name):
+    """Map a charset label to a Python codec name, or None if unknown."""
+    if not name:
+        return None
+    name = CHARSET_ALIASES.get(name.lower(), name)
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+
+def parse_document(extract, content_type, body, detect_bytes=32 * 1024):
+    """Decode raw page bytes and run an extract function on them."""
+    html = body.decode(detect_encoding(content_type, body, detect_bytes), errors='replace')
+    return extract(html)
+
+
+# =========================================
+# EXTRACTION BACKENDS
+# =========================================
+
+
+def clean_lines(text):
+    """Strip lines and drop the ones too short to carry content."""
+    lines = [line.strip() for line in text.splitlines()]
+    lines = [line for line in lines if len(line) > 2]
+    return '\n'.join(lines)
+
+
+def extract_soup(html):
+    """BeautifulSoup (html.parser) backend. Returns (title, text, links)."""
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Links first: nav/footer are removed below, and that is where the
+    # 会社概要 / アクセス links usually live
+    links = [(a['href'], a.get_text(strip=True)[:LINK_TEXT_LIMIT])
+             for a in soup.find_all('a', href=True)]
+    title = soup.title.string.strip() if soup.title and soup.title.string else ''
+
+    for tag in soup.find_all(SKIP_TAGS):
+        tag.decompose()
+    text = clean_lines(soup.get_text(separator='\n'))
+    return title, text, links
+
+
+def extract_lxml(html):
+    """lxml backend. Returns (title, text, links)."""
+    parser = lxml.html.HTMLParser(encoding='utf-8')
+    try:
+        root = lxml.html.document_fromstring(html.encode('utf-8'), parser=parser)
+    except etree.ParserError:  # empty document
+        return '', '', []
+
+    links = [(a.get('href'), a.text_content().strip()[:LINK_TEXT_LIMIT])
+             for a in root.iter('a') if a.get('href')]
+    title_el = root.find('.//title')
+    title = (title_el.text or '').strip() if title_el is not None else ''
+
+    for el in list(root.iter(*SKIP_TAGS, etree.Comment)):
+        el.drop_tree()
+    text = clean_lines('\n'.join(root.itertext()))
+    return title, text, links
+
+
+def extract_selectolax(html):
+    """selectolax backend. Returns (title, text, links)."""
+    tree = SelectolaxParser(html)
+    if tree.root is None:
+        return '', '', []
+
+    links = [(a.attributes.get('href'), a.text(strip=True)[:LINK_TEXT_LIMIT])
+             for a in tree.css('a[href]') if a.attributes.get('href')]
+    title_el = tree.css_first('title')
+    title = title_el.text(strip=True) if title_el is not None else ''
+
+    tree.strip_tags(SKIP_TAGS)
+    text = clean_lines(tree.root.text(separator='\n'))
+    return title, text, links
+
+
+BACKENDS = {
+    'selectolax': (extract_selectolax, SelectolaxParser is not None),
+    'lxml': (extract_lxml, lxml is not None),
+    'soup': (extract_soup, True),
+}
+
+
+def available_backends():
+    """Names of the backends that can run here, fastest first."""
+    return [name for name, (_, ok) in BACKENDS.items() if ok]
+
+
+def get_extractor(name='auto'):
+    """Return the extract function for a backend, falling back to 'soup'."""
+    if name == 'auto':
+        name = available_backends()[0]
+    func, ok = BACKENDS.get(name, (None, False))
+    if not ok:
+        print(f"[Extract] Backend '{name}' unavailable, using BeautifulSoup")
+        return extract_soup
+    return func
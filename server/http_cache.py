@@ -0,0 +1,184 @@
+"""
+不動産市場把握AI - HTTP Response Cache
+SQLite-backed on-disk cache for crawled pages with ETag / Last-Modified
+revalidation, a TTL policy and LRU eviction by total body size.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+class HttpCache:
+    """Process-wide response store shared by all CachedSession instances."""
+
+    def __init__(self, path, max_bytes=200 * 1024 * 1024, fresh_ttl=3600,
+                 max_age=7 * 24 * 3600, max_entry_bytes=5 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.fresh_ttl = fresh_ttl          # served without revalidation
+        self.max_age = max_age              # dropped entirely after this
+        self.max_entry_bytes = max_entry_bytes
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                final_url TEXT,
+                status INTEGER,
+                content_type TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                body BLOB,
+                size INTEGER,
+                stored_at REAL,
+                last_access REAL
+            )
+        ''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)')
+        self.db.commit()
+
+    def lookup(self, url):
+        """Return the cached entry dict for url, or None (expired entries are deleted)."""
+        with self.lock:
+            row = self.db.execute(
+                'SELECT final_url, status, content_type, etag, last_modified, body, stored_at '
+                'FROM responses WHERE url = ?', (url,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            now = time.time()
+            if now - row[6] > self.max_age:
+                self.db.execute('DELETE FROM responses WHERE url = ?', (url,))
+                self.db.commit()
+                return None
+
+            self.db.execute('UPDATE responses SET last_access = ? WHERE url = ?', (now, url))
+            self.db.commit()
+
+        return {
+            'final_url': row[0],
+            'status': row[1],
+            'content_type': row[2],
+            'etag': row[3],
+            'last_modified': row[4],
+            'body': row[5],
+            'fresh': now - row[6] <= self.fresh_ttl,
+        }
+
+    def store(self, url, resp, body=None):
+        """Store a 200 response (unless it is too large or marked no-store).
+
+        `body` is passed by callers that streamed the response themselves.
+        """
+        if resp.status_code != 200:
+            return
+        if 'no-store' in resp.headers.get('Cache-Control', ''):
+            return
+        if body is None:
+            body = resp.content
+        if len(body) > self.max_entry_bytes:
+            return
+
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, resp.url, resp.status_code, resp.headers.get('Content-Type', ''),
+                 resp.headers.get('ETag'), resp.headers.get('Last-Modified'),
+                 body, len(body), now, now)
+            )
+            self._evict()
+            self.db.commit()
+
+    def touch(self, url):
+        """Mark an entry as freshly validated (after a 304)."""
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                'UPDATE responses SET stored_at = ?, last_access = ? WHERE url = ?', (now, now, url)
+            )
+            self.db.commit()
+
+    def _evict(self):
+        """Drop least recently used entries until the total size fits max_bytes."""
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.db.execute('SELECT url, size FROM responses ORDER BY last_access').fetchall()
+        for url, size in rows:
+            if total <= self.max_bytes:
+                break
+            self.db.execute('DELETE FROM responses WHERE url = ?', (url,))
+            total -= size
+
+
+class CachedSession(requests.Session):
+    """requests.Session whose GETs go through an HttpCache.
+
+    Fresh entries are served from disk; stale ones are revalidated with
+    If-None-Match / If-Modified-Since. Counters are per session, so one
+    crawl's hit/miss numbers can be reported on its own. Streamed
+    responses (stream=True) are not stored here: the caller reads the body
+    and calls cache.store() itself.
+    """
+
+    def __init__(self, cache):
+        super().__init__()
+        self.cache = cache
+        self.stats = {'hits': 0, 'revalidated': 0, 'misses': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def get(self, url, **kwargs):
+        entry = self.cache.lookup(url)
+        if entry and entry['fresh']:
+            self._count('hits')
+            return self._from_cache(url, entry)
+
+        if entry:
+            headers = dict(kwargs.pop('headers', None) or {})
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+            kwargs['headers'] = headers
+
+        resp = super().get(url, **kwargs)
+        if entry and resp.status_code == 304:
+            self.cache.touch(url)
+            self._count('revalidated')
+            return self._from_cache(url, entry)
+
+        self._count('misses')
+        if not kwargs.get('stream'):
+            self.cache.store(url, resp)
+        return resp
+
+    def _from_cache(self, url, entry):
+        """Build a requests.Response from a cache entry."""
+        resp = requests.Response()
+        resp.status_code = entry['status']
+        resp._content = entry['body']
+        resp._content_consumed = True
+        resp.from_cache = True
+        resp.url = entry['final_url'] or url
+        resp.headers = CaseInsensitiveDict({'Content-Type': entry['content_type'] or ''})
+        if entry['etag']:
+            resp.headers['ETag'] = entry['etag']
+        if entry['last_modified']:
+            resp.headers['Last-Modified'] = entry['last_modified']
+        return resp
@@ -0,0 +1,187 @@
+"""
+不動産市場把握AI - Incremental JSON Parsing
+Parses an LLM's JSON reply while it is still arriving. Text before the
+first '{' / '[' (a ```json fence, a preamble) and after the closing
+bracket is ignored. Every value that closes at depth 1..max_depth is
+reported as (path, value) as soon as its last character arrives, e.g.
+(('company', 'name'), '...') or (('locations', 0), {...}).
+
+When the reply is cut off or turns invalid, partial() recovers what was
+complete: the values parsed so far, with open containers down to
+keep_depth kept and anything deeper dropped.
+"""
+
+import json
+import re
+from json.decoder import scanstring
+
+SCALAR_RE = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][-+]?\d+)?|true|false|null')
+LITERALS = {'true': True, 'false': False, 'null': None}
+WHITESPACE = ' \t\r\n'
+DELIMITERS = WHITESPACE + ',}]'
+
+
+class IncrementalJSONParser:
+    """Feed text chunks; get completed (path, value) pairs back."""
+
+    def __init__(self, max_depth=2):
+        self.max_depth = max_depth
+        self.buffer = ''
+        self.pos = 0
+        # Open containers: {'value', 'path', 'key', 'state'}; key is the
+        # member name being read in an object
+        self.stack = []
+        self.value = None
+        self.done = False
+        self.error = None
+
+    def feed(self, text):
+        """Consume more text. Returns the (path, value) pairs completed by it."""
+        self.buffer += text
+        events = []
+        if self.done or self.error:
+            return events
+        try:
+            self._parse(events)
+        except ValueError as e:
+            self.error = e
+        # Keep the buffer small: everything before pos is consumed
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        return events
+
+    def _parse(self, events):
+        buf = self.buffer
+        if not self.stack:
+            starts = [i for i in (buf.find('{', self.pos), buf.find('[', self.pos)) if i >= 0]
+            if not starts:
+                self.pos = len(buf)
+                return
+            self.pos = min(starts)
+            self._open(buf[self.pos], ())
+            self.pos += 1
+
+        while self.stack:
+            while self.pos < len(buf) and buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos >= len(buf):
+                return
+            frame = self.stack[-1]
+            char = buf[self.pos]
+            state = frame['state']
+
+            # A closing bracket right after '[', '{' or a trailing comma is accepted
+            if state == 'comma_or_end' or (state in ('first', 'key', 'value') and char in '}]'):
+                if char == ',':
+                    frame['state'] = 'key' if isinstance(frame['value'], dict) else 'value'
+                    self.pos += 1
+                elif char == ('}' if isinstance(frame['value'], dict) else ']'):
+                    self.pos += 1
+                    self._close(events)
+                else:
+                    raise ValueError(f'unexpected {char!r} at {frame["path"]}')
+            elif isinstance(frame['value'], dict) and state in ('first', 'key'):
+                if char != '"':
+                    raise ValueError(f'expected a member name at {frame["path"]}')
+                end = self._string_end(buf)
+                if end is None:
+                    return
+                frame['key'], self.pos = scanstring(buf, self.pos + 1, False)
+                frame['state'] = 'colon'
+            elif state == 'colon':
+                if char != ':':
+                    raise ValueError(f'expected ":" at {frame["path"]}')
+                frame['state'] = 'value'
+                self.pos += 1
+            else:
+                path = frame['path'] + (frame['key'] if isinstance(frame['value'], dict)
+                                        else len(frame['value']),)
+                if char in '{[':
+                    frame['state'] = 'comma_or_end'
+                    self._open(char, path)
+                    self.pos += 1
+                elif char == '"':
+                    if self._string_end(buf) is None:
+                        return
+                    value, self.pos = scanstring(buf, self.pos + 1, False)
+                    self._add(value, events)
+                else:
+                    match = SCALAR_RE.match(buf, self.pos)
+                    # A scalar is complete only once a delimiter follows it;
+                    # until then a number may still continue ("-1." + "5")
+                    if match is None or match.end() == len(buf) or buf[match.end()] not in DELIMITERS:
+                        if not _may_continue(buf[self.pos:]):
+                            raise ValueError(f'invalid value at {path}')
+                        return
+                    text = match.group()
+                    self._add(LITERALS[text] if text in LITERALS else json.loads(text), events)
+                    self.pos = match.end()
+
+    def _string_end(self, buf):
+        """Index after the closing quote of the string at pos, or None if it has not arrived."""
+        i = self.pos + 1
+        while True:
+            i = buf.find('"', i)
+            if i < 0:
+                return None
+            backslashes = 0
+            while buf[i - 1 - backslashes] == '\\':
+                backslashes += 1
+            if backslashes % 2 == 0:
+                return i + 1
+            i += 1
+
+    def _open(self, char, path):
+        self.stack.append({'value': {} if char == '{' else [], 'path': path,
+                           'key': None, 'state': 'first'})
+
+    def _add(self, value, events):
+        frame = self.stack[-1]
+        if isinstance(frame['value'], dict):
+            path = frame['path'] + (frame['key'],)
+            frame['value'][frame['key']] = value
+        else:
+            path = frame['path'] + (len(frame['value']),)
+            frame['value'].append(value)
+        frame['state'] = 'comma_or_end'
+        if len(path) <= self.max_depth:
+            events.append((path, value))
+
+    def _close(self, events):
+        frame = self.stack.pop()
+        if not self.stack:
+            self.value = frame['value']
+            self.done = True
+            return
+        parent = self.stack[-1]
+        if isinstance(parent['value'], dict):
+            parent['value'][parent['key']] = frame['value']
+        else:
+            parent['value'].append(frame['value'])
+        if len(frame['path']) <= self.max_depth:
+            events.append((frame['path'], frame['value']))
+
+    def partial(self, keep_depth=1):
+        """Best-effort value recovered so far (None if no JSON started)."""
+        if self.done:
+            return self.value
+        if not self.stack:
+            return None
+        child = None
+        for frame in reversed(self.stack):
+            value = dict(frame['value']) if isinstance(frame['value'], dict) else list(frame['value'])
+            if child is not None and len(child[0]) <= keep_depth:
+                if isinstance(value, dict):
+                    value[frame['key']] = child[1]
+                else:
+                    value.append(child[1])
+            child = (frame['path'], value)
+        return child[1]
+
+
+def _may_continue(text):
+    """True if text could be the start of a number or literal."""
+    if re.fullmatch(r'-?\d*(?:\.\d*)?(?:[eE][-+]?\d*)?', text):
+        return True
+    return any(literal.startswith(text) for literal in LITERALS)
+
@@ -0,0 +1,251 @@
+"""
+不動産市場把握AI - tochidai.info Slug Index
+Prebuilt (prefecture, city) -> tochidai.info city page URL index, plus a
+cache of parsed land prices per page, so a land price lookup is at most one
+targeted fetch (none while the parsed price is fresh).
+
+Link texts on each prefecture index page are matched exactly against the
+municipality master (full names, or unambiguous short ward / town names via
+MunicipalStatsStore.resolve) instead of by substring, so 市 names that
+contain each other no longer collide. A prefecture is re-indexed when its
+entry is older than max_age. A refresh that fails or finds no city links
+(changed layout, error page) keeps the previous entries and is retried
+after retry_after instead of max_age.
+
+Usage:
+    python land_price_index.py build [--prefectures 愛知県 ...]
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import urljoin, urlparse
+
+from bs4 import BeautifulSoup
+
+from municipal_stats import BASE_DIR, get_default_store
+
+DEFAULT_INDEX_PATH = os.environ.get(
+    'LAND_PRICE_INDEX_PATH', os.path.join(BASE_DIR, 'data', 'land_price_index.sqlite3')
+)
+TOCHIDAI_BASE = 'https://tochidai.info'
+
+# Decorations around the municipality name in link texts
+LINK_TEXT_SUFFIX_RE = re.compile(r'(の)?(地価|土地価格|公示地価|基準地価).*$')
+PARENS_RE = re.compile(r'[（(].*?[)）]')
+
+
+class LandPriceIndex:
+    """SQLite-backed slug index and parsed-price cache for tochidai.info."""
+
+    def __init__(self, path=DEFAULT_INDEX_PATH, store=None,
+                 max_age=30 * 24 * 3600, price_ttl=7 * 24 * 3600, retry_after=3600):
+        self.path = path
+        self.store = store or get_default_store()
+        self.max_age = max_age
+        self.price_ttl = price_ttl
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.refresh_locks = {}
+        self.failed_at = {}     # prefecture -> time of the last failed refresh
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS prefectures (
+                prefecture TEXT PRIMARY KEY,
+                indexed_at REAL
+            )
+        ''')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS cities (
+                prefecture TEXT,
+                city TEXT,
+                url TEXT,
+                PRIMARY KEY (prefecture, city)
+            )
+        ''')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS prices (
+                url TEXT PRIMARY KEY,
+                result TEXT,
+                parsed_at REAL
+            )
+        ''')
+        self.db.commit()
+
+    # =========================================
+    # SLUG INDEX
+    # =========================================
+    def lookup(self, prefecture, city, pref_slug, fetch):
+        """City page URL for a location, or None.
+
+        fetch(url) returns the page body; it is only called when the
+        prefecture has never been indexed or its index is stale. Wards
+        without their own page fall back to the parent city.
+        """
+        self._ensure_fresh(prefecture, pref_slug, fetch)
+
+        code = self.store.resolve(prefecture, city)
+        canonical = self.store.by_code[code]['city'] if code else city
+        names = [canonical]
+        ward = re.match(r'^(.+?市).+区$', canonical)
+        if ward:
+            names.append(ward.group(1))
+
+        with self.lock:
+            for name in names:
+                row = self.db.execute(
+                    'SELECT url FROM cities WHERE prefecture = ? AND city = ?', (prefecture, name)
+                ).fetchone()
+                if row:
+                    return row[0]
+        return None
+
+    def _is_fresh(self, prefecture):
+        """Indexed within max_age, or a refresh failed within retry_after."""
+        with self.lock:
+            row = self.db.execute(
+                'SELECT indexed_at FROM prefectures WHERE prefecture = ?', (prefecture,)
+            ).fetchone()
+            failed_at = self.failed_at.get(prefecture)
+        now = time.time()
+        if row and now - row[0] < self.max_age:
+            return True
+        return failed_at is not None and now - failed_at < self.retry_after
+
+    def _ensure_fresh(self, prefecture, pref_slug, fetch):
+        if self._is_fresh(prefecture):
+            return
+        with self.lock:
+            refresh_lock = self.refresh_locks.setdefault(prefecture, threading.Lock())
+
+        # One refresh per prefecture at a time; the others reuse its result
+        with refresh_lock:
+            if self._is_fresh(prefecture):
+                return
+            try:
+                html = fetch(f'{TOCHIDAI_BASE}/{pref_slug}/')
+            except Exception as e:
+                # Keep serving the previous entries (if any) until the retry
+                print(f"[LandPriceIndex] {prefecture}: index page failed ({e}), "
+                      f"retrying in {self.retry_after}s")
+                with self.lock:
+                    self.failed_at[prefecture] = time.time()
+                return
+            self.index_prefecture(prefecture, pref_slug, html)
+
+    def index_prefecture(self, prefecture, pref_slug, html):
+        """Replace a prefecture's entries with the city links found on its index page.
+
+        A page without any recognizable city link leaves the entries and
+        indexed_at untouched, so the refresh is retried after retry_after.
+        """
+        index_url = f'{TOCHIDAI_BASE}/{pref_slug}/'
+        soup = BeautifulSoup(html, 'html.parser')
+        found = {}
+        for a in soup.find_all('a', href=True):
+            url = urljoin(index_url, a['href'])
+            path = urlparse(url).path
+            if not path.startswith(f'/{pref_slug}/') or path.rstrip('/') == f'/{pref_slug}':
+                continue
+            name = self._link_name(a.get_text(strip=True))
+            code = self.store.resolve(prefecture, name) if name else None
+            if code is None:
+                continue
+            city = self.store.by_code[code]['city']
+            found.setdefault(city, url)
+
+        if not found:
+            with self.lock:
+                self.failed_at[prefecture] = time.time()
+                kept = self.db.execute(
+                    'SELECT COUNT(*) FROM cities WHERE prefecture = ?', (prefecture,)
+                ).fetchone()[0]
+            print(f"[LandPriceIndex] {prefecture}: no city links on the index page, "
+                  f"keeping {kept} previous entries (retry in {self.retry_after}s)")
+            return found
+
+        with self.lock:
+            self.failed_at.pop(prefecture, None)
+            self.db.execute('DELETE FROM cities WHERE prefecture = ?', (prefecture,))
+            self.db.executemany(
+                'INSERT INTO cities VALUES (?, ?, ?)',
+                [(prefecture, city, url) for city, url in found.items()]
+            )
+            self.db.execute('INSERT OR REPLACE INTO prefectures VALUES (?, ?)', (prefecture, time.time()))
+            self.db.commit()
+        print(f"[LandPriceIndex] {prefecture}: {len(found)} city pages indexed")
+        return found
+
+    def _link_name(self, text):
+        text = PARENS_RE.sub('', ''.join(text.split()))
+        return LINK_TEXT_SUFFIX_RE.sub('', text)
+
+    # =========================================
+    # PARSED PRICES
+    # =========================================
+    def get_price(self, url):
+        """Parsed land price for a city page if it is younger than price_ttl."""
+        with self.lock:
+            row = self.db.execute(
+                'SELECT result, parsed_at FROM prices WHERE url = ?', (url,)
+            ).fetchone()
+        if row is None or time.time() - row[1] >= self.price_ttl:
+            return None
+        return json.loads(row[0])
+
+    def save_price(self, url, result):
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO prices VALUES (?, ?, ?)',
+                (url, json.dumps(result, ensure_ascii=False), time.time())
+            )
+            self.db.commit()
+
+
+_default_index = None
+_default_lock = threading.Lock()
+
+
+def get_default_index():
+    """Process-wide index shared by every MarketDataFetcher."""
+    global _default_index
+    with _default_lock:
+        if _default_index is None:
+            _default_index = LandPriceIndex(DEFAULT_INDEX_PATH)
+        return _default_index
+
+
+def main():
+    from market_data import MarketDataFetcher
+
+    parser = argparse.ArgumentParser(description='tochidai.info slug index')
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help='(re)index prefecture pages')
+    build.add_argument('--prefectures', nargs='+', help='default: all 47')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        fetcher = MarketDataFetcher()
+        index = LandPriceIndex(DEFAULT_INDEX_PATH)
+        for prefecture in args.prefectures or list(fetcher.prefecture_codes):
+            slug = fetcher._prefecture_to_english(prefecture)
+            if not slug:
+                print(f"[LandPriceIndex] Unknown prefecture: {prefecture}")
+                continue
+            try:
+                html = fetcher._cached_get('tochidai', f'{TOCHIDAI_BASE}/{slug}/')
+                index.index_prefecture(prefecture, slug, html)
+            except Exception as e:
+                print(f"[LandPriceIndex] {prefecture} failed: {e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+不動産市場把握AI - LLM Result Cache
+SQLite-backed cache of analysis results keyed by a hash of everything that
+determines the model output (model, prompt template version, the combined
+page text and the generation config), with a TTL and LRU eviction by total
+size. Identical content analyzed by anyone, under any URL spelling, is a
+hit.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def cache_key(model, template_version, combined_text, config):
+    """Content address of one LLM call."""
+    payload = json.dumps([model, template_version, combined_text, config],
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """Persistent result store shared by all BusinessAnalyzer instances."""
+
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, ttl=30 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'bypassed': 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                result TEXT,
+                size INTEGER,
+                stored_at REAL,
+                last_access REAL
+            )
+        ''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS idx_llm_last_access ON results(last_access)')
+        self.db.commit()
+
+    def get(self, key):
+        """Return (result, stored_at) for a fresh entry, or None."""
+        with self.lock:
+            row = self.db.execute(
+                'SELECT result, stored_at FROM results WHERE key = ?', (key,)
+            ).fetchone()
+            now = time.time()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self.db.execute('DELETE FROM results WHERE key = ?', (key,))
+                    self.db.commit()
+                self.stats['misses'] += 1
+                return None
+            self.db.execute('UPDATE results SET last_access = ? WHERE key = ?', (now, key))
+            self.db.commit()
+            self.stats['hits'] += 1
+        return json.loads(row[0]), row[1]
+
+    def put(self, key, model, result):
+        data = json.dumps(result, ensure_ascii=False)
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                (key, model, data, len(data.encode('utf-8')), now, now)
+            )
+            self._evict()
+            self.db.commit()
+
+    def count_bypass(self):
+        with self.lock:
+            self.stats['bypassed'] += 1
+
+    def _evict(self):
+        """Drop expired entries, then least recently used ones until under max_bytes."""
+        self.db.execute('DELETE FROM results WHERE stored_at < ?', (time.time() - self.ttl,))
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.db.execute('SELECT key, size FROM results ORDER BY last_access').fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self.db.execute('DELETE FROM results WHERE key = ?', (key,))
+            total -= size
@@ -0,0 +1,189 @@
+"""
+不動産市場把握AI - Shared Gemini Client
+One long-lived, process-wide Gemini client: genai is configured and the
+model constructed once, and every call passes through
+
+  - a request bucket (RPM) and a token bucket (TPM) sized to the quota,
+  - a concurrency cap on in-flight calls,
+  - exponential backoff with full jitter on 429 / 5xx.
+
+Each call reports how long it queued for quota and slots, so it is visible
+whether analysis latency is quota-bound.
+"""
+
+import random
+import threading
+import time
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+from ratelimit import TokenBucket
+
+# Rough size of Japanese prompts; only used to spend TPM tokens up front
+CHARS_PER_TOKEN = 2
+
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+
+def is_retryable(error):
+    """429 / 5xx from the API (or a transport error without a status)."""
+    if isinstance(error, google_exceptions.GoogleAPICallError):
+        return error.code in RETRYABLE_CODES
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+class StreamInterrupted(Exception):
+    """A streamed reply failed after some of its text was delivered."""
+
+    def __init__(self, error, call_info):
+        super().__init__(f'{type(error).__name__}: {error}')
+        self.error = error
+        self.call_info = call_info
+
+
+class GeminiClient:
+    """Rate-limited, retrying wrapper around one GenerativeModel."""
+
+    def __init__(self, api_key, model='gemini-2.0-flash', rpm=15, tpm=1_000_000,
+                 max_concurrency=4, max_retries=4, base_delay=1.0, max_delay=30.0):
+        genai.configure(api_key=api_key)
+        self.model_name = model
+        self.model = genai.GenerativeModel(model)
+        # Small bursts only: a full minute's burst on top of the steady rate
+        # would exceed the per-minute quota
+        self.request_bucket = TokenBucket(rpm / 60.0, capacity=max(1, rpm // 6))
+        self.token_bucket = TokenBucket(tpm / 60.0, capacity=max(1, tpm // 6))
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.counters = {'calls': 0, 'attempts': 0, 'retries': 0, 'failures': 0,
+                         'queue_wait_total': 0.0, 'queue_wait_max': 0.0}
+
+    def estimate_tokens(self, prompt, max_output_tokens):
+        return len(prompt) // CHARS_PER_TOKEN + max_output_tokens
+
+    def generate(self, prompt, temperature=0.3, max_output_tokens=2000, **kwargs):
+        """Call generate_content under the quota. Returns (response, call_info).
+
+        call_info: queue_wait_ms (time spent waiting for quota and a slot,
+        summed over attempts), retry_wait_ms, attempts, latency_ms.
+        kwargs are passed through to generate_content; use generate_stream()
+        for streamed replies.
+        """
+        def call(config):
+            return self.model.generate_content(prompt, generation_config=config, **kwargs)
+
+        return self._call(prompt, temperature, max_output_tokens, call)
+
+    def generate_stream(self, prompt, on_text, temperature=0.3, max_output_tokens=2000):
+        """Stream the reply, calling on_text(text) per chunk. Returns call_info.
+
+        The slot is held until the stream is exhausted. A failure before any
+        text arrived is retried like generate(); one after raises
+        StreamInterrupted, since the caller already has part of the reply.
+        call_info also carries streamed and first_text_ms.
+        """
+        started = time.monotonic()
+        first_text = []
+
+        def call(config):
+            for chunk in self.model.generate_content(prompt, generation_config=config, stream=True):
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue  # chunk without text (finish reason, safety ratings)
+                if not first_text:
+                    first_text.append(round((time.monotonic() - started) * 1000))
+                on_text(text)
+
+        def stream_info(call_info):
+            return dict(call_info, streamed=True, first_text_ms=first_text[0] if first_text else None)
+
+        try:
+            _, call_info = self._call(prompt, temperature, max_output_tokens, call,
+                                      retry_allowed=lambda: not first_text)
+        except StreamInterrupted as e:
+            e.call_info = stream_info(e.call_info)
+            raise
+        return stream_info(call_info)
+
+    def _call(self, prompt, temperature, max_output_tokens, call, retry_allowed=None):
+        """Run call(config) holding a slot and quota, retrying 429 / 5xx.
+
+        retry_allowed() is asked before retrying; when it says no, the error
+        is raised as StreamInterrupted.
+        """
+        config = genai.GenerationConfig(temperature=temperature, max_output_tokens=max_output_tokens)
+        tokens = self.estimate_tokens(prompt, max_output_tokens)
+        started = time.monotonic()
+        queue_wait = 0.0
+        retry_wait = 0.0
+        attempt = 0
+
+        def call_info():
+            return {
+                'model': self.model_name,
+                'attempts': attempt,
+                'queue_wait_ms': round(queue_wait * 1000),
+                'retry_wait_ms': round(retry_wait * 1000),
+                'latency_ms': round((time.monotonic() - started) * 1000),
+            }
+
+        while True:
+            attempt += 1
+            waited_from = time.monotonic()
+            with self.slots:
+                self.request_bucket.acquire()
+                self.token_bucket.acquire(tokens)
+                queue_wait += time.monotonic() - waited_from
+                try:
+                    response = call(config)
+                    error = None
+                except Exception as e:
+                    error = e
+
+            if error is None:
+                break
+            if retry_allowed is not None and not retry_allowed():
+                self._record(attempt, queue_wait, failed=True)
+                raise StreamInterrupted(error, call_info()) from error
+            if attempt > self.max_retries or not is_retryable(error):
+                self._record(attempt, queue_wait, failed=True)
+                raise error
+
+            # Full jitter: uniform over [0, min(cap, base * 2^n)]; the slot is
+            # released while sleeping so other calls can use it
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+            print(f"[LLM] {type(error).__name__}, retry {attempt} in {delay:.1f}s")
+            time.sleep(delay)
+            retry_wait += delay
+
+        self._record(attempt, queue_wait)
+        if queue_wait > 1:
+            print(f"[LLM] Quota-bound: waited {queue_wait:.1f}s for rate limit / slot")
+        return response, call_info()
+
+    def _record(self, attempts, queue_wait, failed=False):
+        with self.lock:
+            c = self.counters
+            c['calls'] += 1
+            c['attempts'] += attempts
+            c['retries'] += attempts - 1
+            c['failures'] += int(failed)
+            c['queue_wait_total'] += queue_wait
+            c['queue_wait_max'] = max(c['queue_wait_max'], queue_wait)
+
+    def stats(self):
+        """Counters for /api/health."""
+        with self.lock:
+            c = dict(self.counters)
+        calls = c.pop('calls')
+        total = c.pop('queue_wait_total')
+        c['queue_wait_max_ms'] = round(c.pop('queue_wait_max') * 1000)
+        c['queue_wait_avg_ms'] = round(total / calls * 1000) if calls else None
+        c['calls'] = calls
+        c['model'] = self.model_name
+        return c
@@ -1,6 +1,10 @@
 """
 不動産市場把握AI - Market Data Fetcher
 Fetches open data from e-Stat and web scraping for market analysis.
+The six categories (and several locations) are fetched concurrently on
+bounded, process-wide thread pools. Every category is read from the local
+municipality statistics store (municipal_stats.py) before any network call;
+upstream responses go through the process-wide cache (upstream_cache.py).
 """
 
 import requests
@@ -8,13 +12,94 @@ import re
 import os
 import json
 from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from municipal_stats import get_default_store
+from upstream_cache import get_default_cache
+from land_price_index import get_default_index
+from resilience import get_breaker
+
+
+# Process-wide pools: one for per-category fetches, one for locations.
+# Kept separate so location tasks never wait on a pool they are filling.
+CATEGORY_POOL = ThreadPoolExecutor(max_workers=24, thread_name_prefix='market-category')
+LOCATION_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix='market-location')
+
+# e-Stat API root (override to point at estat_fixture_server.py)
+ESTAT_API_BASE = os.environ.get('ESTAT_API_BASE', 'https://api.e-stat.go.jp/rest/3.0/app/json')
+
+# Potential-customer model defaults (shared with potential_ranking.py)
+DEFAULT_AGE_30_45_PCT = 20    # % of households in the 30-45 target band
+DEFAULT_OWNERSHIP_RATE = 50   # % owner-occupied
+RENTAL_CONVERT_RATE = 0.015   # renters buying per year, when starts are unknown
+
+# Field layout of each category when no data could be fetched
+EMPTY_CATEGORY = {
+    'population': {'total_population': None, 'households': None,
+                   'age_30_45_pct': None, 'elderly_pct': None},
+    'construction': {'owner_occupied': None, 'total': None, 'yoy_change': None, 'year': None},
+    'housing': {'ownership_rate': None, 'vacancy_rate': None, 'rental_vacancy': None},
+    'land_price': {'residential_tsubo': None, 'residential_sqm': None,
+                   'commercial_sqm': None, 'yoy_change': None},
+    'home_prices': {'avg_price': None, 'price_range': None, 'required_income': None},
+    'competition': {'total_companies': None, 'local_builders': None},
+}
+
+
+def dedupe_locations(locations, store):
+    """Collapse locations naming the same municipality.
+
+    Returns (distinct, groups): one representative location per area and,
+    for each, the input indices that map to it. Locations the master does
+    not know are grouped by their cleaned-up (prefecture, city) text.
+    """
+    distinct = []
+    groups = []
+    seen = {}
+    for i, location in enumerate(locations):
+        prefecture = location.get('prefecture', '')
+        city = location.get('city', '')
+        code = store.normalize(prefecture, city)
+        if code is not None:
+            record = store.by_code[code]
+            key = code
+            canonical = {'prefecture': record['prefecture'], 'city': record['city']}
+        else:
+            key = (''.join(prefecture.split()), ''.join(city.split()))
+            canonical = {'prefecture': prefecture, 'city': city}
+        if key not in seen:
+            seen[key] = len(distinct)
+            distinct.append(canonical)
+            groups.append([])
+        groups[seen[key]].append(i)
+    return distinct, groups
+
+
+def fan_out(results, groups, locations):
+    """Copy each distinct area's result back to every location that maps to it."""
+    fanned = [None] * len(locations)
+    for result, indices in zip(results, groups):
+        for i in indices:
+            prefecture = locations[i].get('prefecture', '')
+            city = locations[i].get('city', '')
+            copy = dict(result)
+            copy.update({'area_name': f"{prefecture} {city}", 'prefecture': prefecture, 'city': city})
+            fanned[i] = copy
+    return fanned
 
 
 class MarketDataFetcher:
     """Fetches market data from multiple open data sources."""
 
-    def __init__(self, estat_key=''):
+    def __init__(self, estat_key='', category_timeout=20, stats_store=None, upstream_cache=None,
+                 land_index=None, hedge=None):
         self.estat_api_key = estat_key or os.environ.get('ESTAT_API_KEY', '')
+        self.stats = stats_store or get_default_store()
+        self.upstream = upstream_cache or get_default_cache()
+        self.land_index = land_index or get_default_index()
+        # Hedged upstream requests (second attempt after the p95 latency)
+        self.hedge = hedge if hedge is not None else os.environ.get('MARKET_HEDGE_REQUESTS') == '1'
+        self.category_timeout = category_timeout  # seconds per fetch_all()
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
@@ -38,7 +123,12 @@ class MarketDataFetcher:
         }
 
     def fetch_all(self, location):
-        """Fetch all 6 data categories for a given location."""
+        """Fetch all 6 data categories for a given location.
+
+        Categories run concurrently; any that have not finished within
+        category_timeout come back empty and are listed in 'timed_out'.
+        One that fails or returns nothing comes back empty as well.
+        """
         prefecture = location.get('prefecture', '')
         city = location.get('city', '')
         area_name = f"{prefecture} {city}"
@@ -49,34 +139,95 @@ class MarketDataFetcher:
             'city': city
         }
 
-        # ① Population & Demographics (e-Stat)
-        result['population'] = self._fetch_population(prefecture, city)
-
-        # ② Construction Starts
-        result['construction'] = self._fetch_construction(prefecture, city)
-
-        # ③ Housing ownership / vacancy
-        result['housing'] = self._fetch_housing(prefecture, city)
-
-        # ④ Land prices
-        result['land_price'] = self._fetch_land_prices(prefecture, city)
+        categories = [
+            ('population', self._fetch_population),      # ① Population & Demographics (e-Stat)
+            ('construction', self._fetch_construction),  # ② Construction Starts
+            ('housing', self._fetch_housing),            # ③ Housing ownership / vacancy
+            ('land_price', self._fetch_land_prices),     # ④ Land prices
+            ('home_prices', self._fetch_home_prices),    # ⑤ New home prices
+            ('competition', self._fetch_competition),    # ⑥ Competition
+        ]
+        futures = {key: CATEGORY_POOL.submit(func, prefecture, city) for key, func in categories}
+        wait(futures.values(), timeout=self.category_timeout)
+
+        timed_out = []
+        for key, future in futures.items():
+            if not future.done():
+                future.cancel()
+                timed_out.append(key)
+                result[key] = self._empty_category(key, 'タイムアウト')
+                continue
+            try:
+                data = future.result()
+            except Exception as e:
+                print(f"[MarketData] {key} error: {e}")
+                data = self._empty_category(key, 'エラー')
+            result[key] = data or self._empty_category(key, 'データなし')
+        if timed_out:
+            print(f"[MarketData] Timed out for {area_name}: {', '.join(timed_out)}")
+            result['timed_out'] = timed_out
+
+        # Calculate potential customers (join step)
+        result['potential'] = self._calculate_potential(result)
 
-        # ⑤ New home prices
-        result['home_prices'] = self._fetch_home_prices(prefecture, city)
+        return result
 
-        # ⑥ Competition
-        result['competition'] = self._fetch_competition(prefecture, city)
+    def fetch_many(self, locations):
+        """fetch_all() for several locations concurrently, results in input order.
 
-        # Calculate potential customers
-        result['potential'] = self._calculate_potential(result)
+        Locations that normalize to the same municipality are fetched once
+        (see dedupe_locations). A location that fails comes back with empty
+        categories instead of failing the whole batch.
+        """
+        distinct, groups = dedupe_locations(locations, self.stats)
+        return fan_out(list(LOCATION_POOL.map(self._fetch_location, distinct)), groups, locations)
 
-        return result
+    def _fetch_location(self, location):
+        try:
+            return self.fetch_all(location)
+        except Exception as e:
+            prefecture = location.get('prefecture', '')
+            city = location.get('city', '')
+            print(f"[MarketData] {prefecture} {city} error: {e}")
+            result = {'area_name': f"{prefecture} {city}", 'prefecture': prefecture, 'city': city}
+            for key in EMPTY_CATEGORY:
+                result[key] = self._empty_category(key, 'エラー')
+            result['potential'] = self._calculate_potential(result)
+            return result
+
+    def _empty_category(self, key, source):
+        data = dict(EMPTY_CATEGORY[key])
+        data['source'] = source
+        return data
+
+    def _cached_get(self, source, url, params=None, timeout=10):
+        """GET an upstream body (bytes) through the shared cache.
+
+        The key leaves out appId so every fetcher shares entries. Misses go
+        through the source's circuit breaker, which fails fast (CircuitOpenError)
+        while the upstream is unhealthy; a stale cached copy is served then.
+        """
+        key = (url, tuple(sorted((k, str(v)) for k, v in (params or {}).items() if k != 'appId')))
+
+        def request():
+            resp = self.session.get(url, params=params, timeout=timeout)
+            resp.raise_for_status()
+            return resp.content
+
+        def load():
+            return get_breaker(source).call(request, hedge=self.hedge)
+
+        return self.upstream.get_or_load(source, key, load)
 
     # =========================================
     # ① POPULATION & DEMOGRAPHICS
     # =========================================
     def _fetch_population(self, prefecture, city):
-        """Fetch population data from e-Stat API or web scraping."""
+        """Fetch population data from the local store, e-Stat API or web scraping."""
+        data = self.stats.get(prefecture, city, 'population')
+        if data:
+            return data
+
         # Try e-Stat API
         if self.estat_api_key:
             try:
@@ -91,7 +242,7 @@ class MarketDataFetcher:
     def _fetch_population_estat(self, prefecture, city):
         """Fetch population from e-Stat API."""
         # statsDataId for national census population by city
-        url = 'https://api.e-stat.go.jp/rest/3.0/app/json/getStatsData'
+        url = f'{ESTAT_API_BASE}/getStatsData'
         params = {
             'appId': self.estat_api_key,
             'statsDataId': '0003448233',  # 国勢調査 人口等基本集計
@@ -99,8 +250,7 @@ class MarketDataFetcher:
             'limit': 100
         }
 
-        resp = self.session.get(url, params=params, timeout=15)
-        data = resp.json()
+        data = json.loads(self._cached_get('estat', url, params, timeout=15))
 
         # Parse e-Stat response (complex structure)
         # Simplified - return estimated data
@@ -113,12 +263,7 @@ class MarketDataFetcher:
             # Try city-population.de/en (has good data)
             area = f"{prefecture}{city}"
             url = f"https://www.google.com/search?q={requests.utils.quote(query)}+統計"
-            # Can't reliably scrape Google, return estimates based on known data patterns
-
-            # Known population data for major cities (sample)
-            known_data = self._get_known_population(prefecture, city)
-            if known_data:
-                return known_data
+            # Can't reliably scrape Google
 
             return {
                 'total_population': None,
@@ -137,45 +282,12 @@ class MarketDataFetcher:
                 'source': 'エラー'
             }
 
-    def _get_known_population(self, prefecture, city):
-        """Return known population data for common areas."""
-        # Pre-loaded data for demo purposes
-        known = {
-            ('愛知県', '天白区'): {
-                'total_population': 162506,
-                'households': 80962,
-                'age_30_45_pct': 19.5,
-                'elderly_pct': 23.3,
-                'working_age_pct': 64.4,
-                'source': '名古屋市統計 (2025年1月)'
-            },
-            ('愛知県', '名古屋市'): {
-                'total_population': 2331264,
-                'households': 1120000,
-                'age_30_45_pct': 20.1,
-                'elderly_pct': 24.8,
-                'working_age_pct': 63.2,
-                'source': '名古屋市統計 (2024年)'
-            }
-        }
-        return known.get((prefecture, city))
-
     # =========================================
     # ② CONSTRUCTION STARTS
     # =========================================
     def _fetch_construction(self, prefecture, city):
         """Fetch construction start statistics."""
-        known = {
-            ('愛知県', '天白区'): {
-                'owner_occupied': 107,
-                'total': 580,
-                'yoy_change': '前年比 -3.2%',
-                'year': '2023年',
-                'source': '名古屋市建築着工統計'
-            }
-        }
-
-        data = known.get((prefecture, city))
+        data = self.stats.get(prefecture, city, 'construction')
         if data:
             return data
 
@@ -200,7 +312,7 @@ class MarketDataFetcher:
         if not pref_code:
             return None
 
-        url = 'https://api.e-stat.go.jp/rest/3.0/app/json/getStatsData'
+        url = f'{ESTAT_API_BASE}/getStatsData'
         params = {
             'appId': self.estat_api_key,
             'statsDataId': '0003426741',  # 建築着工統計調査
@@ -208,8 +320,7 @@ class MarketDataFetcher:
             'limit': 50
         }
 
-        resp = self.session.get(url, params=params, timeout=15)
-        data = resp.json()
+        data = json.loads(self._cached_get('estat', url, params, timeout=15))
 
         # Parse response
         stat_data = data.get('GET_STATS_DATA', {}).get('STATISTICAL_DATA', {})
@@ -231,16 +342,7 @@ class MarketDataFetcher:
     # =========================================
     def _fetch_housing(self, prefecture, city):
         """Fetch homeownership rate and vacancy data."""
-        known = {
-            ('愛知県', '天白区'): {
-                'ownership_rate': 48.5,
-                'vacancy_rate': 12.3,
-                'rental_vacancy': 14.5,
-                'source': '住宅・土地統計調査 (2023年)'
-            }
-        }
-
-        data = known.get((prefecture, city))
+        data = self.stats.get(prefecture, city, 'housing')
         if data:
             return data
 
@@ -257,24 +359,7 @@ class MarketDataFetcher:
     def _fetch_land_prices(self, prefecture, city):
         """Fetch land price data from tochidai.info."""
         try:
-            query = f"{prefecture}{city}"
-            # Map to tochidai.info URL patterns
-            url = f"https://tochidai.info/aichi/nagoya-tempaku/"  # Example
-
-            # For production, build URL dynamically
-            # For now, use known data or scraping
-
-            known = {
-                ('愛知県', '天白区'): {
-                    'residential_tsubo': 652049,
-                    'residential_sqm': 197244,
-                    'commercial_sqm': 237800,
-                    'yoy_change': '+3.53%',
-                    'source': '公示地価・基準地価 (2025年)'
-                }
-            }
-
-            data = known.get((prefecture, city))
+            data = self.stats.get(prefecture, city, 'land_price')
             if data:
                 return data
 
@@ -291,25 +376,23 @@ class MarketDataFetcher:
             }
 
     def _scrape_land_prices(self, prefecture, city):
-        """Scrape land prices from tochidai.info."""
-        # Convert prefecture/city to URL slug
+        """Land prices from the city's tochidai.info page (via the slug index)."""
         pref_en = self._prefecture_to_english(prefecture)
         if not pref_en:
             return {'residential_tsubo': None, 'source': '未対応の地域'}
 
-        city_clean = city.replace('市', '').replace('区', '').replace('町', '').replace('村', '')
-
         try:
-            url = f"https://tochidai.info/{pref_en}/"
-            resp = self.session.get(url, timeout=10)
-            soup = BeautifulSoup(resp.text, 'html.parser')
-
-            # Find link matching the city
-            for link in soup.find_all('a'):
-                if city_clean in link.get_text():
-                    city_url = link.get('href', '')
-                    if city_url:
-                        return self._parse_land_price_page(city_url)
+            city_url = self.land_index.lookup(
+                prefecture, city, pref_en, lambda url: self._cached_get('tochidai', url)
+            )
+            if city_url:
+                cached = self.land_index.get_price(city_url)
+                if cached:
+                    return cached
+                data = self._parse_land_price_page(city_url)
+                if data.get('source') == 'tochidai.info':
+                    self.land_index.save_price(city_url, data)
+                return data
 
         except Exception as e:
             print(f"[MarketData] Land scraping error: {e}")
@@ -328,8 +411,7 @@ class MarketDataFetcher:
             if not url.startswith('http'):
                 url = f"https://tochidai.info{url}"
 
-            resp = self.session.get(url, timeout=10)
-            soup = BeautifulSoup(resp.text, 'html.parser')
+            soup = BeautifulSoup(self._cached_get('tochidai', url), 'html.parser')
 
             # Look for price tables
             text = soup.get_text()
@@ -360,16 +442,7 @@ class MarketDataFetcher:
     # =========================================
     def _fetch_home_prices(self, prefecture, city):
         """Fetch new home price data."""
-        known = {
-            ('愛知県', '天白区'): {
-                'avg_price': 4356,
-                'price_range': '3,000万〜7,200万円',
-                'required_income': 871,
-                'source': 'SUUMO/LIFULL HOME\'S'
-            }
-        }
-
-        data = known.get((prefecture, city))
+        data = self.stats.get(prefecture, city, 'home_prices')
         if data:
             return data
 
@@ -385,15 +458,7 @@ class MarketDataFetcher:
     # =========================================
     def _fetch_competition(self, prefecture, city):
         """Fetch competition data (number of builders in the area)."""
-        known = {
-            ('愛知県', '天白区'): {
-                'total_companies': 156,
-                'local_builders': 10,
-                'source': 'SUUMO (2025年)'
-            }
-        }
-
-        data = known.get((prefecture, city))
+        data = self.stats.get(prefecture, city, 'competition')
         if data:
             return data
 
@@ -430,10 +495,10 @@ class MarketDataFetcher:
             }
 
         # Calculate
-        target_hh = round(households * (age_pct or 20) / 100)
-        rental_rate = (100 - (ownership_rate or 50)) / 100
+        target_hh = round(households * (age_pct or DEFAULT_AGE_30_45_PCT) / 100)
+        rental_rate = (100 - (ownership_rate or DEFAULT_OWNERSHIP_RATE)) / 100
         rental_hh = round(target_hh * rental_rate)
-        annual = owner_starts or round(rental_hh * 0.015)
+        annual = owner_starts or round(rental_hh * RENTAL_CONVERT_RATE)
         per_company = round(annual / total_companies, 2) if total_companies else None
 
         # AI insight
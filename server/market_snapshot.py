@@ -0,0 +1,183 @@
+"""
+不動産市場把握AI - Nationwide Market Snapshot
+Offline builder that runs MarketDataFetcher.fetch_all over every
+municipality with bounded concurrency and writes one versioned snapshot
+file, and the reader the Flask app serves /api/market-data from.
+
+A build writes market-<version>.json.gz next to the previous ones and then
+replaces the CURRENT pointer file (temp file + rename), so a reader never
+sees a half-written snapshot. MarketSnapshot re-reads CURRENT at most every
+check_interval seconds and swaps in the new version without a restart.
+Areas that timed out or errored during the build are left out, so the app
+fetches them live.
+
+Usage (e.g. nightly from cron):
+    python market_snapshot.py build [--concurrency 8] [--keep 3]
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from municipal_stats import BASE_DIR, get_default_store
+
+DEFAULT_SNAPSHOT_DIR = os.environ.get(
+    'MARKET_SNAPSHOT_DIR', os.path.join(BASE_DIR, 'data', 'snapshots')
+)
+POINTER_NAME = 'CURRENT'
+
+
+def area_key(prefecture, city):
+    return f'{prefecture}/{city}'
+
+
+# =========================================
+# BUILD
+# =========================================
+def build_snapshot(directory=DEFAULT_SNAPSHOT_DIR, concurrency=8, keep=3, fetcher=None):
+    """Fetch every municipality and publish a new snapshot version."""
+    from market_data import MarketDataFetcher
+
+    fetcher = fetcher or MarketDataFetcher()
+    records = sorted(fetcher.stats.by_code.values(), key=lambda r: r['code'])
+    started = time.time()
+    areas = {}
+    skipped = 0
+
+    def fetch(record):
+        location = {'prefecture': record['prefecture'], 'city': record['city']}
+        try:
+            return record, fetcher.fetch_all(location)
+        except Exception as e:
+            print(f"[Snapshot] {record['prefecture']} {record['city']} failed: {e}")
+            return record, None
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='snapshot') as pool:
+        for done, (record, result) in enumerate(pool.map(fetch, records), 1):
+            if result is None or result.get('timed_out'):
+                skipped += 1
+            else:
+                areas[area_key(record['prefecture'], record['city'])] = result
+            if done % 200 == 0:
+                print(f"[Snapshot] {done}/{len(records)} areas ({time.time() - started:.0f}s)")
+
+    version = time.strftime('%Y%m%d%H%M%S')
+    snapshot = {'version': version, 'built_at': time.time(), 'areas': areas}
+    os.makedirs(directory, exist_ok=True)
+    filename = f'market-{version}.json.gz'
+    _atomic_write(os.path.join(directory, filename),
+                  gzip.compress(json.dumps(snapshot, ensure_ascii=False).encode('utf-8')))
+    _atomic_write(os.path.join(directory, POINTER_NAME), filename.encode('ascii'))
+
+    for old in sorted(glob.glob(os.path.join(directory, 'market-*.json.gz')))[:-keep]:
+        os.remove(old)
+    print(f"[Snapshot] Published {filename}: {len(areas)} areas, {skipped} left to live fetch, "
+          f"{time.time() - started:.0f}s")
+    return version
+
+
+def _atomic_write(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+# =========================================
+# SERVE
+# =========================================
+class MarketSnapshot:
+    """Read side: current snapshot in memory, hot-swapped when CURRENT changes."""
+
+    def __init__(self, directory=DEFAULT_SNAPSHOT_DIR, store=None, check_interval=30):
+        self.directory = directory
+        self.store = store or get_default_store()
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.current = None     # (filename, snapshot dict), replaced as a whole
+        self.checked_at = 0
+        self.reload()
+
+    def reload(self):
+        """Load the version CURRENT points to, if it is not the one in memory."""
+        self.checked_at = time.time()
+        try:
+            with open(os.path.join(self.directory, POINTER_NAME), encoding='ascii') as f:
+                filename = f.read().strip()
+        except FileNotFoundError:
+            return False
+        if self.current and self.current[0] == filename:
+            return False
+
+        with self.lock:
+            if self.current and self.current[0] == filename:
+                return False
+            try:
+                with gzip.open(os.path.join(self.directory, filename), 'rb') as f:
+                    snapshot = json.loads(f.read().decode('utf-8'))
+            except (OSError, ValueError) as e:
+                print(f"[Snapshot] Could not load {filename}: {e}")
+                return False
+            self.current = (filename, snapshot)
+        print(f"[Snapshot] Serving version {snapshot['version']} ({len(snapshot['areas'])} areas)")
+        return True
+
+    def _maybe_reload(self):
+        if time.time() - self.checked_at >= self.check_interval:
+            self.reload()
+
+    @property
+    def version(self):
+        current = self.current
+        return current[1]['version'] if current else None
+
+    def get(self, location):
+        """Snapshot result for a location (shaped like fetch_all), or None."""
+        self._maybe_reload()
+        current = self.current
+        if current is None:
+            return None
+
+        prefecture = location.get('prefecture', '')
+        city = location.get('city', '')
+        code = self.store.resolve(prefecture, city)
+        if code is None:
+            return None
+        result = current[1]['areas'].get(area_key(prefecture, self.store.by_code[code]['city']))
+        if result is None:
+            return None
+
+        result = dict(result)
+        result.update({'area_name': f"{prefecture} {city}", 'prefecture': prefecture, 'city': city,
+                       'snapshot_version': current[1]['version']})
+        return result
+
+    def stats(self):
+        self._maybe_reload()
+        current = self.current
+        if current is None:
+            return {'version': None, 'areas': 0}
+        return {'version': current[1]['version'], 'areas': len(current[1]['areas']),
+                'built_at': current[1]['built_at']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Nationwide market data snapshot')
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help='fetch every municipality and publish a snapshot')
+    build.add_argument('--output', default=DEFAULT_SNAPSHOT_DIR)
+    build.add_argument('--concurrency', type=int, default=8)
+    build.add_argument('--keep', type=int, default=3, help='snapshot versions to keep')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_snapshot(args.output, concurrency=args.concurrency, keep=args.keep)
+
+
+if __name__ == '__main__':
+    main()
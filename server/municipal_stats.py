@@ -0,0 +1,384 @@
+"""
+不動産市場把握AI - Municipality Statistics Store
+Local statistics for every municipality in area-database.js, keyed by
+municipality code, so MarketDataFetcher can answer without a network call.
+
+The store is a single SQLite file with one row per municipality; each
+category (population, construction, housing, land_price, home_prices,
+competition) is a JSON column with the same layout fetch_all() returns.
+On open every row is loaded into dicts, so lookups are O(1).
+
+Codes are the official 5-digit 全国地方公共団体コード when the store is
+built with --codes (総務省 code list CSV); otherwise provisional
+"<pref>-<nnn>" codes are assigned from the master order.
+
+Centroids (lat/lon per municipality) and adjacency pairs are imported from
+CSV for trade-area queries (trade_area.py); rows are matched by code, or by
+prefecture + city when the file has no code column.
+
+Usage:
+    python municipal_stats.py build [--codes codes.csv]
+    python municipal_stats.py centroids centroids.csv   # code|prefecture,city + lat,lon
+    python municipal_stats.py adjacency adjacency.csv   # code_a,code_b
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+import sqlite3
+import threading
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+AREA_DATABASE_PATH = os.path.join(BASE_DIR, '..', 'area-database.js')
+SEED_PATH = os.path.join(BASE_DIR, 'data', 'municipal_stats_seed.json')
+DEFAULT_STORE_PATH = os.environ.get(
+    'MUNICIPAL_STATS_PATH', os.path.join(BASE_DIR, 'data', 'municipal_stats.sqlite3')
+)
+
+CATEGORIES = ['population', 'construction', 'housing', 'land_price', 'home_prices', 'competition']
+
+ADD_PREF_RE = re.compile(r"\['([^']+)','(\d{2})'\]")
+ADD_CITY_RE = re.compile(r"_addCity\('([^']+)','((?:[^'\\]|\\.)+)'\)")
+WARD_RE = re.compile(r'^(.+?市)(.+区)$')
+
+
+def load_master(path=AREA_DATABASE_PATH):
+    """Read (pref_code, prefecture, city) from area-database.js.
+
+    Designated cities (名古屋市 etc.) only appear there as their wards, so a
+    city-level entry is added for each of them as well.
+    """
+    with open(path, encoding='utf-8') as f:
+        source = f.read()
+
+    pref_codes = dict(ADD_PREF_RE.findall(source))
+    master = []
+    seen = set()
+    for prefecture, city in ADD_CITY_RE.findall(source):
+        city = city.replace("\\'", "'")
+        names = [city]
+        ward = WARD_RE.match(city)
+        if ward:
+            names.insert(0, ward.group(1))
+        for name in names:
+            if (prefecture, name) not in seen:
+                seen.add((prefecture, name))
+                master.append((pref_codes.get(prefecture, '00'), prefecture, name))
+    return master
+
+
+def load_code_list(path):
+    """Read {(prefecture, city): code} from the 総務省 code list CSV.
+
+    Expected columns: 団体コード, 都道府県名（漢字）, 市区町村名（漢字）. Six-digit
+    codes with a check digit are cut to five.
+    """
+    codes = {}
+    with open(path, encoding='utf-8-sig') as f:
+        for row in csv.reader(f):
+            if len(row) < 3 or not row[0][:5].isdigit():
+                continue
+            prefecture, city = row[1].strip(), row[2].strip()
+            if city:
+                codes[(prefecture, city)] = row[0][:5]
+    return codes
+
+
+def build_store(path=DEFAULT_STORE_PATH, codes_path=None, seed_path=SEED_PATH):
+    """(Re)build the store: every master municipality, plus the seed statistics."""
+    master = load_master()
+    official = load_code_list(codes_path) if codes_path else {}
+
+    rows = []
+    ordinals = {}
+    for pref_code, prefecture, city in master:
+        ordinals[pref_code] = ordinals.get(pref_code, 0) + 1
+        code = official.get((prefecture, city)) or f"{pref_code}-{ordinals[pref_code]:03d}"
+        rows.append((code, pref_code, prefecture, city))
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    db = sqlite3.connect(path)
+    db.execute('DROP TABLE IF EXISTS municipalities')
+    db.execute(f'''
+        CREATE TABLE municipalities (
+            code TEXT PRIMARY KEY,
+            pref_code TEXT,
+            prefecture TEXT,
+            city TEXT,
+            {', '.join(f'{c} TEXT' for c in CATEGORIES)},
+            lat REAL,
+            lon REAL
+        )
+    ''')
+    db.executemany(
+        'INSERT INTO municipalities (code, pref_code, prefecture, city) VALUES (?, ?, ?, ?)', rows
+    )
+    db.execute('CREATE UNIQUE INDEX idx_name ON municipalities(prefecture, city)')
+    db.execute('DROP TABLE IF EXISTS adjacency')
+    db.execute('CREATE TABLE adjacency (code_a TEXT, code_b TEXT, PRIMARY KEY (code_a, code_b))')
+    db.commit()
+    db.close()
+
+    store = MunicipalStatsStore(path)
+    if os.path.exists(seed_path):
+        with open(seed_path, encoding='utf-8') as f:
+            seed = json.load(f)
+        for entry in seed.get('municipalities', []):
+            code = store.resolve(entry['prefecture'], entry['city'])
+            if code is None:
+                print(f"[MunicipalStats] Seed area not in master: {entry['prefecture']} {entry['city']}")
+                continue
+            store.update(code, {c: entry[c] for c in CATEGORIES if c in entry})
+    print(f"[MunicipalStats] Built {path}: {len(rows)} municipalities "
+          f"({len(official)} official codes)")
+    return store
+
+
+class MunicipalStatsStore:
+    """In-memory view of the SQLite store with O(1) lookups by code or name."""
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.by_code = {}
+        self.code_by_name = {}
+        self.adjacency = {}
+        self._pref_names = None
+        self.version = 0  # bumped on every write, for derived caches
+        self._migrate()
+        self._load()
+
+    def _migrate(self):
+        """Add the centroid / adjacency schema to stores built before it existed."""
+        db = sqlite3.connect(self.path)
+        try:
+            columns = {row[1] for row in db.execute('PRAGMA table_info(municipalities)')}
+            for column in ('lat', 'lon'):
+                if column not in columns:
+                    db.execute(f'ALTER TABLE municipalities ADD COLUMN {column} REAL')
+            db.execute('CREATE TABLE IF NOT EXISTS adjacency '
+                       '(code_a TEXT, code_b TEXT, PRIMARY KEY (code_a, code_b))')
+            db.commit()
+        finally:
+            db.close()
+
+    def _load(self):
+        db = sqlite3.connect(self.path)
+        try:
+            rows = db.execute(
+                f"SELECT code, pref_code, prefecture, city, lat, lon, {', '.join(CATEGORIES)} "
+                f"FROM municipalities"
+            ).fetchall()
+            pairs = db.execute('SELECT code_a, code_b FROM adjacency').fetchall()
+        finally:
+            db.close()
+
+        for row in rows:
+            code, pref_code, prefecture, city, lat, lon = row[:6]
+            record = {'code': code, 'pref_code': pref_code, 'prefecture': prefecture, 'city': city,
+                      'lat': lat, 'lon': lon}
+            for category, value in zip(CATEGORIES, row[6:]):
+                record[category] = json.loads(value) if value else None
+            self.by_code[code] = record
+            self.code_by_name[(prefecture, city)] = code
+
+        for a, b in pairs:
+            self.adjacency.setdefault(a, set()).add(b)
+            self.adjacency.setdefault(b, set()).add(a)
+
+        # Short ward / town names (天白区, 上川町) resolve when unambiguous
+        short = {}
+        for (prefecture, city), code in self.code_by_name.items():
+            for suffix in self._short_names(city):
+                short.setdefault((prefecture, suffix), set()).add(code)
+        self._short_names_index = {k: v.pop() for k, v in short.items() if len(v) == 1}
+
+    def _short_names(self, city):
+        ward = WARD_RE.match(city)
+        if ward:
+            yield ward.group(2)
+        county = re.match(r'^.+?郡(.+[町村])$', city)
+        if county:
+            yield county.group(1)
+
+    def resolve(self, prefecture, city):
+        """Municipality code for a (prefecture, city) name, or None."""
+        code = self.code_by_name.get((prefecture, city))
+        if code is None:
+            code = self._short_names_index.get((prefecture, city))
+        return code
+
+    def normalize(self, prefecture, city):
+        """Code for a location as written by users / the analyzer, or None.
+
+        Tolerates spaces, the prefecture repeated in the city field
+        (愛知県名古屋市天白区) and a missing prefecture when the city name is
+        unique nationwide.
+        """
+        prefecture = ''.join((prefecture or '').split())
+        city = ''.join((city or '').split())
+        if prefecture and city.startswith(prefecture):
+            city = city[len(prefecture):]
+        if not prefecture:
+            if self._pref_names is None:
+                self._pref_names = {r['prefecture'] for r in self.by_code.values()}
+            prefecture = next((p for p in self._pref_names if city.startswith(p)), '')
+            city = city[len(prefecture):]
+        if prefecture:
+            return self.resolve(prefecture, city)
+        matches = [code for (_, name), code in self.code_by_name.items() if name == city]
+        return matches[0] if len(matches) == 1 else None
+
+    def get(self, prefecture, city, category):
+        """Stored statistics for one category, or None if the area/category is missing."""
+        code = self.resolve(prefecture, city)
+        if code is None:
+            return None
+        data = self.by_code[code].get(category)
+        return dict(data) if data else None
+
+    def update(self, code, categories):
+        """Write category dicts for one municipality (used by build / ingest)."""
+        with self.lock:
+            record = self.by_code[code]
+            db = sqlite3.connect(self.path)
+            try:
+                for category, data in categories.items():
+                    record[category] = data
+                    db.execute(
+                        f'UPDATE municipalities SET {category} = ? WHERE code = ?',
+                        (json.dumps(data, ensure_ascii=False), code)
+                    )
+                db.commit()
+                self.version += 1
+            finally:
+                db.close()
+
+    def update_many(self, updates):
+        """update() for many municipalities in one transaction: {code: categories}."""
+        with self.lock:
+            db = sqlite3.connect(self.path)
+            try:
+                for code, categories in updates.items():
+                    record = self.by_code[code]
+                    for category, data in categories.items():
+                        record[category] = data
+                        db.execute(
+                            f'UPDATE municipalities SET {category} = ? WHERE code = ?',
+                            (json.dumps(data, ensure_ascii=False), code)
+                        )
+                db.commit()
+                self.version += 1
+            finally:
+                db.close()
+
+    def set_centroids(self, centroids):
+        """Write {code: (lat, lon)} in one transaction."""
+        with self.lock:
+            db = sqlite3.connect(self.path)
+            try:
+                for code, (lat, lon) in centroids.items():
+                    self.by_code[code].update({'lat': lat, 'lon': lon})
+                    db.execute('UPDATE municipalities SET lat = ?, lon = ? WHERE code = ?',
+                               (lat, lon, code))
+                db.commit()
+                self.version += 1
+            finally:
+                db.close()
+
+    def set_adjacency(self, pairs):
+        """Replace the adjacency pairs [(code_a, code_b), ...] (stored both ways)."""
+        with self.lock:
+            db = sqlite3.connect(self.path)
+            try:
+                db.execute('DELETE FROM adjacency')
+                db.executemany('INSERT OR IGNORE INTO adjacency VALUES (?, ?)',
+                               [tuple(sorted(pair)) for pair in pairs])
+                db.commit()
+                self.adjacency = {}
+                for a, b in pairs:
+                    self.adjacency.setdefault(a, set()).add(b)
+                    self.adjacency.setdefault(b, set()).add(a)
+                self.version += 1
+            finally:
+                db.close()
+
+    def _code_for_row(self, row):
+        if row.get('code'):
+            code = row['code'].strip()
+            if len(code) == 6 and code.isdigit():  # drop the check digit
+                code = code[:5]
+            return code if code in self.by_code else None
+        return self.resolve(row.get('prefecture', '').strip(), row.get('city', '').strip())
+
+    def import_centroids(self, path):
+        """Load centroids from a CSV with lat, lon and code or prefecture + city columns."""
+        centroids = {}
+        missing = 0
+        with open(path, encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                code = self._code_for_row(row)
+                if code is None:
+                    missing += 1
+                    continue
+                centroids[code] = (float(row['lat']), float(row['lon']))
+        self.set_centroids(centroids)
+        print(f"[MunicipalStats] Centroids for {len(centroids)} municipalities ({missing} unmatched)")
+        return len(centroids)
+
+    def import_adjacency(self, path):
+        """Load adjacency pairs from a CSV with code_a, code_b columns."""
+        pairs = []
+        with open(path, encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                a = self._code_for_row({'code': row['code_a']})
+                b = self._code_for_row({'code': row['code_b']})
+                if a and b and a != b:
+                    pairs.append((a, b))
+        self.set_adjacency(pairs)
+        print(f"[MunicipalStats] {len(pairs)} adjacency pairs")
+        return len(pairs)
+
+
+_default_store = None
+_default_lock = threading.Lock()
+
+
+def get_default_store():
+    """Process-wide store, built from area-database.js + seed on first use."""
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            if os.path.exists(DEFAULT_STORE_PATH):
+                _default_store = MunicipalStatsStore(DEFAULT_STORE_PATH)
+            else:
+                _default_store = build_store(DEFAULT_STORE_PATH)
+        return _default_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Municipality statistics store')
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help='rebuild the store from area-database.js and the seed')
+    build.add_argument('--codes', help='総務省 全国地方公共団体コード CSV')
+    build.add_argument('--output', default=DEFAULT_STORE_PATH)
+    centroids = sub.add_parser('centroids', help='import municipality centroids (CSV)')
+    centroids.add_argument('csv')
+    adjacency = sub.add_parser('adjacency', help='import adjacent municipality pairs (CSV)')
+    adjacency.add_argument('csv')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_store(args.output, codes_path=args.codes)
+    elif args.command == 'centroids':
+        get_default_store().import_centroids(args.csv)
+    elif args.command == 'adjacency':
+        get_default_store().import_adjacency(args.csv)
+
+
+if __name__ == '__main__':
+    main()
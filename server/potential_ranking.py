@@ -0,0 +1,170 @@
+"""
+不動産市場把握AI - Potential Customer Ranking
+Batch version of MarketDataFetcher._calculate_potential: the same formulas
+and defaults, evaluated with NumPy over every municipality in the
+statistics store at once, plus ranking / filtering by prefecture or region.
+
+The column arrays are built once from the store and rebuilt only when the
+store has been written to (MunicipalStatsStore.version), so a ranking query
+is a mask + argsort over ~1,900 rows.
+"""
+
+import threading
+
+import numpy as np
+
+from market_data import DEFAULT_AGE_30_45_PCT, DEFAULT_OWNERSHIP_RATE, RENTAL_CONVERT_RATE
+from municipal_stats import get_default_store
+
+# 地方 -> prefecture codes
+REGIONS = {
+    '北海道': ['01'],
+    '東北': ['02', '03', '04', '05', '06', '07'],
+    '関東': ['08', '09', '10', '11', '12', '13', '14'],
+    '中部': ['15', '16', '17', '18', '19', '20', '21', '22', '23'],
+    '近畿': ['24', '25', '26', '27', '28', '29', '30'],
+    '中国': ['31', '32', '33', '34', '35'],
+    '四国': ['36', '37', '38', '39'],
+    '九州': ['40', '41', '42', '43', '44', '45', '46', '47'],
+}
+
+# (category, field) read from the store for each input column
+INPUT_FIELDS = {
+    'total_population': ('population', 'total_population'),
+    'households': ('population', 'households'),
+    'age_30_45_pct': ('population', 'age_30_45_pct'),
+    'ownership_rate': ('housing', 'ownership_rate'),
+    'owner_starts': ('construction', 'owner_occupied'),
+    'total_companies': ('competition', 'total_companies'),
+}
+
+SORT_KEYS = ['per_company', 'target_households', 'rental_households', 'annual_converts',
+             'households', 'total_population']
+
+
+def as_number(value):
+    """Store value as float, NaN when missing or non-numeric."""
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else np.nan
+
+
+def compute_potential(cols):
+    """Vectorized _calculate_potential over column arrays (NaN = missing).
+
+    Missing or zero inputs fall back exactly like the scalar version
+    (`value or default`); rows without population/households get NaN
+    targets and keep the raw owner-occupied starts as annual converts.
+    """
+    def present(a):
+        return ~np.isnan(a) & (a != 0)
+
+    households = cols['households']
+    valid = present(cols['total_population']) & present(households)
+
+    age = np.where(present(cols['age_30_45_pct']), cols['age_30_45_pct'], DEFAULT_AGE_30_45_PCT)
+    ownership = np.where(present(cols['ownership_rate']), cols['ownership_rate'], DEFAULT_OWNERSHIP_RATE)
+
+    target = np.round(households * age / 100)
+    rental = np.round(target * ((100 - ownership) / 100))
+    starts = cols['owner_starts']
+    annual = np.where(present(starts), starts, np.round(rental * RENTAL_CONVERT_RATE))
+
+    companies = cols['total_companies']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(present(companies), annual / companies, np.nan)
+    # np.round(x, 2) scales by 100 first (147/40 -> 3.68) while round() is
+    # correctly rounded (3.67); this runs once per table build, so match it
+    per_company = np.array([round(x, 2) for x in ratio.tolist()])
+
+    nan = np.full(len(households), np.nan)
+    return {
+        'target_households': np.where(valid, target, nan),
+        'rental_households': np.where(valid, rental, nan),
+        'annual_converts': np.where(valid, annual, starts),
+        'per_company': np.where(valid, per_company, nan),
+    }
+
+
+class PotentialTable:
+    """Column arrays for every municipality plus the computed potential."""
+
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.version = None
+        self._build()
+
+    def _build(self):
+        records = sorted(self.store.by_code.values(), key=lambda r: r['code'])
+        self.version = self.store.version
+        self.codes = np.array([r['code'] for r in records])
+        self.prefectures = np.array([r['prefecture'] for r in records])
+        self.cities = np.array([r['city'] for r in records])
+        self.pref_codes = np.array([r['pref_code'] for r in records])
+
+        cols = {}
+        for name, (category, field) in INPUT_FIELDS.items():
+            cols[name] = np.array([as_number((r.get(category) or {}).get(field)) for r in records])
+        self.columns = cols
+        self.columns.update(compute_potential(cols))
+
+    def _refresh(self):
+        with self.lock:
+            if self.version != self.store.version:
+                self._build()
+
+    def rank(self, sort='per_company', descending=True, prefectures=None, region=None,
+             min_households=None, limit=50):
+        """Top municipalities by a potential column; rows lacking it sort last."""
+        if sort not in SORT_KEYS:
+            raise ValueError(f'unknown sort key: {sort}')
+        self._refresh()
+
+        mask = np.ones(len(self.codes), dtype=bool)
+        if prefectures:
+            mask &= np.isin(self.prefectures, prefectures)
+        if region:
+            if region not in REGIONS:
+                raise ValueError(f'unknown region: {region}')
+            mask &= np.isin(self.pref_codes, REGIONS[region])
+        if min_households is not None:
+            mask &= np.nan_to_num(self.columns['households'], nan=-1) >= min_households
+
+        idx = np.flatnonzero(mask)
+        values = self.columns[sort][idx]
+        keys = np.where(np.isnan(values), np.inf, -values if descending else values)
+        order = idx[np.lexsort((self.codes[idx], keys))][:limit]
+
+        return {
+            'matched': int(mask.sum()),
+            'with_value': int((~np.isnan(values)).sum()),
+            'results': [self._row(i) for i in order],
+        }
+
+    def _row(self, i):
+        row = {
+            'code': str(self.codes[i]),
+            'prefecture': str(self.prefectures[i]),
+            'city': str(self.cities[i]),
+        }
+        for name, column in self.columns.items():
+            value = column[i]
+            if np.isnan(value):
+                row[name] = None
+            elif name == 'per_company' or value != int(value):
+                row[name] = float(value)
+            else:
+                row[name] = int(value)
+        return row
+
+
+_default_table = None
+_default_lock = threading.Lock()
+
+
+def get_default_table():
+    """Process-wide table over the default municipality store."""
+    global _default_table
+    with _default_lock:
+        if _default_table is None:
+            _default_table = PotentialTable(get_default_store())
+        return _default_table
@@ -0,0 +1,185 @@
+"""
+不動産市場把握AI - Prompt Packing
+Chooses what goes into the analyzer's context budget instead of taking
+pages in crawl order:
+
+  1. Lines that repeat on many pages (headers, menus, footers) are removed
+     from every page and kept once, in a "サイト共通" section, so the
+     address in a footer still counts but only once.
+  2. Pages are cut into segments of a few lines, and each segment is
+     scored by what it carries for the analysis: postal addresses,
+     prefecture/city mentions, 会社概要 fields, 本社/支店/営業所 and service
+     keywords, per character.
+  3. Segments are taken best-first, discounted by how much of their text
+     (character shingles) is already packed, until the budget is full.
+     The chosen segments are emitted in their original page order.
+"""
+
+import heapq
+import math
+import re
+from collections import Counter
+
+from company_profile import POSTAL_ADDRESS_RE, PROFILE_FIELDS, PROFILE_MARKERS
+
+COMMON_TITLE = 'サイト共通'
+
+# A line on at least this share of pages (and at least BOILERPLATE_MIN_PAGES) is boilerplate
+BOILERPLATE_SHARE = 0.5
+BOILERPLATE_MIN_PAGES = 3
+SEGMENT_CHARS = 600
+SHINGLE = 4
+# Segments mostly made of already-packed text are skipped
+MIN_NOVELTY = 0.3
+
+PREFECTURE_CITY_RE = re.compile(
+    r'(北海道|東京都|大阪府|京都府|.{2,3}県)\s*([^\s、。()（）]{1,6}?[市区町村郡])'
+)
+PHONE_RE = re.compile(r'0\d{1,4}-\d{1,4}-\d{3,4}')
+BRANCH_WORDS = ['本社', '本店', '支社', '支店', '営業所', '事業所', '展示場', 'モデルハウス', '店舗']
+SERVICE_WORDS = [
+    '工務店', '不動産', '住宅', 'ハウス', '建築', '建設',
+    '注文住宅', '新築', 'リフォーム', 'リノベーション',
+    'マンション', '賃貸', '分譲', '土地', '仲介', '施工',
+]
+
+
+def normalize_line(line):
+    return ''.join(line.split())
+
+
+def shingles(text):
+    text = ''.join(text.split())
+    return {text[i:i + SHINGLE] for i in range(max(1, len(text) - SHINGLE + 1))}
+
+
+def score_segment(text, title=''):
+    """Information score of one segment (higher = more useful to the analyzer)."""
+    score = 0
+    score += 30 * len(POSTAL_ADDRESS_RE.findall(text))
+    score += 10 * len(PREFECTURE_CITY_RE.findall(text))
+    score += 3 * len(PHONE_RE.findall(text))
+    score += 8 * sum(1 for field in PROFILE_FIELDS if field in text)
+    score += 10 * sum(1 for marker in PROFILE_MARKERS if marker in text or marker in title)
+    score += 8 * sum(1 for word in BRANCH_WORDS if word in text)
+    score += 3 * sum(1 for word in SERVICE_WORDS if word in text)
+    return score
+
+
+def strip_boilerplate(pages):
+    """Remove lines repeated across pages. Returns (pages, common_lines)."""
+    counts = Counter()
+    for page in pages:
+        counts.update({normalize_line(line) for line in page.get('text', '').split('\n')})
+    threshold = max(BOILERPLATE_MIN_PAGES, math.ceil(len(pages) * BOILERPLATE_SHARE))
+    repeated = {line for line, count in counts.items() if line and count >= threshold}
+
+    cleaned = []
+    common = []
+    seen = set()
+    for page in pages:
+        kept = []
+        for line in page.get('text', '').split('\n'):
+            key = normalize_line(line)
+            if key in repeated:
+                if key not in seen:
+                    seen.add(key)
+                    common.append(line)
+            else:
+                kept.append(line)
+        cleaned.append(dict(page, text='\n'.join(kept)))
+    return cleaned, common
+
+
+def segment_pages(pages, max_chars=SEGMENT_CHARS):
+    """[(page index, title, text)] runs of consecutive lines up to max_chars."""
+    segments = []
+    for index, page in enumerate(pages):
+        title = page.get('title', '')
+        lines = []
+        size = 0
+        for line in page.get('text', '').split('\n'):
+            if not line.strip():
+                continue
+            if lines and size + len(line) > max_chars:
+                segments.append((index, title, '\n'.join(lines)))
+                lines, size = [], 0
+            lines.append(line)
+            size += len(line) + 1
+        if lines:
+            segments.append((index, title, '\n'.join(lines)))
+    return segments
+
+
+def clean_pages(pages):
+    """Boilerplate-free pages, with the repeated lines kept once as a last page.
+
+    Returns (pages, number of boilerplate lines).
+    """
+    cleaned, common = strip_boilerplate(pages)
+    if common:
+        cleaned.append({'title': COMMON_TITLE, 'text': '\n'.join(common)})
+    return [page for page in cleaned if page.get('text', '').strip()], len(common)
+
+
+def pack_pages(pages, budget):
+    """Pack the most informative segments into budget characters.
+
+    Returns (text, stats). Without a budget (or when everything fits) the
+    boilerplate-free pages are returned whole, in order.
+    """
+    input_chars = sum(len(page.get('text', '')) for page in pages)
+    cleaned, boilerplate = clean_pages(pages)
+    segments = segment_pages(cleaned)
+
+    def header(index):
+        return f"=== {cleaned[index].get('title', '')} ===\n"
+
+    whole = '\n\n'.join(header(i) + page['text'] for i, page in enumerate(cleaned))
+    stats = {'input_chars': input_chars, 'clean_chars': len(whole),
+             'boilerplate_lines': boilerplate, 'segments': len(segments)}
+    if not budget or len(whole) <= budget:
+        stats.update({'selected': len(segments), 'packed_chars': len(whole)})
+        return whole, stats
+
+    # Lazy greedy: a segment's gain only drops as more text is packed, so the
+    # heap top is re-scored and taken once it still beats the next best
+    heap = []
+    for position, (index, title, text) in enumerate(segments):
+        density = score_segment(text, title) / max(len(text), 200)
+        heapq.heappush(heap, (-density, position, density))
+    packed = set()
+    chosen = []
+    pages_used = set()
+    used = 0
+    while heap:
+        _, position, density = heapq.heappop(heap)
+        index, title, text = segments[position]
+        grams = shingles(text)
+        novelty = len(grams - packed) / len(grams)
+        gain = density * novelty
+        if heap and gain < -heap[0][0]:
+            heapq.heappush(heap, (-gain, position, density))
+            continue
+        if novelty < MIN_NOVELTY:
+            continue
+        cost = len(text) + 1 + (0 if index in pages_used else len(header(index)) + 2)
+        if used + cost > budget:
+            continue
+        chosen.append(position)
+        pages_used.add(index)
+        packed |= grams
+        used += cost
+
+    parts = []
+    current = None
+    for position in sorted(chosen):
+        index, _, text = segments[position]
+        if index != current:
+            parts.append(header(index) + text)
+            current = index
+        else:
+            parts[-1] += '\n' + text
+    text = '\n\n'.join(parts)
+    stats.update({'selected': len(chosen), 'packed_chars': len(text)})
+    return text, stats
@@ -0,0 +1,69 @@
+"""
+不動産市場把握AI - Rate Limiting
+Token buckets and per-host throttles shared by the crawler and API clients.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate` tokens/sec."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` are available and take them. Returns seconds waited."""
+        start = time.monotonic()
+        # Requests larger than the bucket are let through once it is full
+        # (the balance goes negative and later callers pay it back).
+        needed = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= needed:
+                    self.tokens -= tokens
+                    return now - start
+                wait = (needed - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class HostThrottle:
+    """Per-host politeness: a concurrency cap plus a token bucket per host."""
+
+    def __init__(self, rate=4.0, burst=4, concurrency=4):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _get(self, host):
+        with self._lock:
+            entry = self._hosts.get(host)
+            if entry is None:
+                entry = (threading.BoundedSemaphore(self.concurrency),
+                         TokenBucket(self.rate, self.burst))
+                self._hosts[host] = entry
+            return entry
+
+    @contextmanager
+    def slot(self, host):
+        """Hold one of the host's concurrency slots and spend one request token."""
+        semaphore, bucket = self._get(host)
+        with semaphore:
+            bucket.acquire()
+            yield
@@ -0,0 +1,162 @@
+"""
+不動産市場把握AI - Upstream Resilience
+Per-upstream circuit breakers and optional hedged requests, so one slow or
+failing upstream (e-Stat, tochidai.info) fails fast instead of holding every
+request for its full timeout.
+
+A breaker opens after `failure_threshold` consecutive failures (errors, 5xx
+responses or calls slower than slow_call_seconds), rejects calls for
+reset_timeout seconds, then lets one trial call through (half-open) and
+closes again if it succeeds.
+
+A hedged call starts a second attempt when the first has not answered
+within the upstream's recent latency percentile, and returns whichever
+finishes first.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+# Shared by every hedged call; attempts are plain blocking HTTP requests
+HEDGE_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix='hedge')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+
+def is_upstream_failure(error):
+    """Errors that say the upstream is unhealthy (4xx responses do not)."""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code >= 500
+    return True
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with latency tracking for one upstream."""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30,
+                 slow_call_seconds=8.0, latency_window=200):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call_seconds = slow_call_seconds
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.latencies = deque(maxlen=latency_window)
+        self.counters = {'calls': 0, 'failures': 0, 'rejected': 0, 'opened': 0, 'hedged': 0}
+
+    def _before_call(self):
+        with self.lock:
+            if self.state == OPEN:
+                if time.time() - self.opened_at < self.reset_timeout:
+                    self.counters['rejected'] += 1
+                    raise CircuitOpenError(f'{self.name} circuit open')
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self.trial_running:
+                    self.counters['rejected'] += 1
+                    raise CircuitOpenError(f'{self.name} circuit half-open')
+                self.trial_running = True
+            self.counters['calls'] += 1
+
+    def _record(self, ok, elapsed):
+        with self.lock:
+            if ok:
+                self.latencies.append(elapsed)
+            if ok and elapsed <= self.slow_call_seconds:
+                self.failures = 0
+                if self.state == HALF_OPEN:
+                    print(f"[Breaker] {self.name} closed")
+                self.state = CLOSED
+            else:
+                self.failures += 1
+                self.counters['failures'] += 1
+                if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                    if self.state != OPEN:
+                        self.counters['opened'] += 1
+                        print(f"[Breaker] {self.name} open after {self.failures} failures")
+                    self.state = OPEN
+                    self.opened_at = time.time()
+            self.trial_running = False
+
+    def call(self, func, hedge=False, hedge_percentile=95):
+        """Run func() through the breaker (optionally hedged)."""
+        self._before_call()
+        started = time.time()
+        try:
+            if hedge:
+                result = self._hedged(func, hedge_percentile)
+            else:
+                result = func()
+        except Exception as e:
+            self._record(not is_upstream_failure(e), time.time() - started)
+            raise
+        self._record(True, time.time() - started)
+        return result
+
+    def latency_percentile(self, percentile):
+        """Recent successful-call latency at the percentile, or None with few samples."""
+        with self.lock:
+            samples = sorted(self.latencies)
+        if len(samples) < 20:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+    def _hedged(self, func, percentile):
+        delay = self.latency_percentile(percentile)
+        first = HEDGE_POOL.submit(func)
+        if delay is None:
+            return first.result()
+
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+
+        with self.lock:
+            self.counters['hedged'] += 1
+        pending = {first, HEDGE_POOL.submit(func)}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def snapshot(self):
+        """State for /api/health."""
+        p95 = self.latency_percentile(95)
+        with self.lock:
+            return dict(self.counters, state=self.state, consecutive_failures=self.failures,
+                        p95_ms=round(p95 * 1000) if p95 is not None else None)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name, **kwargs):
+    """Process-wide breaker for an upstream (created on first use)."""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, **kwargs)
+        return _breakers[name]
+
+
+def breaker_states():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.name: b.snapshot() for b in breakers}
@@ -0,0 +1,74 @@
+"""
+不動産市場把握AI - SimHash
+64-bit SimHash fingerprints over character shingles (works for Japanese
+text, which has no word boundaries) and a banded index for near-duplicate
+lookups by Hamming distance.
+"""
+
+import hashlib
+from collections import Counter
+
+BITS = 64
+
+
+def simhash(text, shingle=3):
+    """Return the 64-bit SimHash of text, built from character n-grams."""
+    text = ''.join(text.split())
+    if len(text) < shingle:
+        grams = Counter([text]) if text else Counter()
+    else:
+        grams = Counter(text[i:i + shingle] for i in range(len(text) - shingle + 1))
+
+    # Per-bit majority vote, tallied per hash byte value instead of per bit
+    # (8 additions per shingle rather than 64)
+    byte_counts = [[0] * 256 for _ in range(BITS // 8)]
+    for gram, count in grams.items():
+        digest = hashlib.blake2b(gram.encode('utf-8'), digest_size=BITS // 8).digest()
+        for i, value in enumerate(digest):
+            byte_counts[i][value] += count
+
+    total = sum(grams.values())
+    fingerprint = 0
+    for i, counts in enumerate(byte_counts):
+        present = [(value, c) for value, c in enumerate(counts) if c]
+        for bit in range(8):
+            ones = sum(c for value, c in present if value >> bit & 1)
+            if 2 * ones > total:
+                fingerprint |= 1 << (i * 8 + bit)
+    return fingerprint
+
+
+def hamming(a, b):
+    """Number of differing bits between two fingerprints."""
+    return bin(a ^ b).count('1')
+
+
+class SimHashIndex:
+    """Finds stored fingerprints within `threshold` bits of a query.
+
+    The fingerprint is split into threshold + 1 bands; by the pigeonhole
+    principle any match within the threshold agrees exactly on at least one
+    band, so only those buckets are compared.
+    """
+
+    def __init__(self, threshold=3):
+        self.threshold = threshold
+        self.bands = threshold + 1
+        self.width = -(-BITS // self.bands)
+        self.buckets = [{} for _ in range(self.bands)]
+
+    def _keys(self, fingerprint):
+        mask = (1 << self.width) - 1
+        return [(fingerprint >> (i * self.width)) & mask for i in range(self.bands)]
+
+    def find(self, fingerprint):
+        """Return the (fingerprint, key) of a stored near-duplicate, or None."""
+        for band, key in enumerate(self._keys(fingerprint)):
+            for other, item in self.buckets[band].get(key, ()):
+                if hamming(fingerprint, other) <= self.threshold:
+                    return other, item
+        return None
+
+    def add(self, fingerprint, item):
+        for band, key in enumerate(self._keys(fingerprint)):
+            self.buckets[band].setdefault(key, []).append((fingerprint, item))
@@ -0,0 +1,149 @@
+"""
+不動産市場把握AI - Site Manifest
+Per-domain record of crawled pages (URL, content hash, validators, last
+seen) and of the last analysis, so monthly re-runs only refetch changed
+pages and skip the LLM when the site content has not changed. A stored
+analysis is reused only under the same analysis key (model, prompt
+template version, generation config) and within analysis_ttl.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+
+def site_key(url):
+    """Domain key shared by the crawler and analyzer (www. is ignored)."""
+    netloc = urlparse(url).netloc.lower()
+    return netloc[4:] if netloc.startswith('www.') else netloc
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class SiteManifest:
+    """SQLite-backed store of page fingerprints and analyses per domain."""
+
+    def __init__(self, path, analysis_ttl=30 * 24 * 3600):
+        self.path = path
+        self.analysis_ttl = analysis_ttl
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS pages (
+                domain TEXT,
+                url TEXT,
+                content_hash TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                title TEXT,
+                text TEXT,
+                links TEXT,
+                last_seen REAL,
+                PRIMARY KEY (domain, url)
+            )
+        ''')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS analyses (
+                domain TEXT PRIMARY KEY,
+                combined_hash TEXT,
+                result TEXT,
+                analyzed_at REAL,
+                analysis_key TEXT
+            )
+        ''')
+        # Manifests created before analysis_key: their analyses never match
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(analyses)')]
+        if 'analysis_key' not in columns:
+            self.db.execute('ALTER TABLE analyses ADD COLUMN analysis_key TEXT')
+        self.db.commit()
+
+    # =========================================
+    # PAGES
+    # =========================================
+    def load_pages(self, domain):
+        """Return {url: entry} for every page previously seen on the domain."""
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT url, content_hash, etag, last_modified, title, text, links, last_seen '
+                'FROM pages WHERE domain = ?', (domain,)
+            ).fetchall()
+        return {
+            row[0]: {
+                'content_hash': row[1],
+                'etag': row[2],
+                'last_modified': row[3],
+                'title': row[4],
+                'text': row[5],
+                'links': [tuple(link) for link in json.loads(row[6] or '[]')],
+                'last_seen': row[7],
+            }
+            for row in rows
+        }
+
+    def save_pages(self, domain, entries, prune=False, removed=()):
+        """Upsert {url: entry} (same shape as load_pages) with last_seen = now.
+
+        prune=True replaces the domain's pages with entries (after a crawl
+        that reached every page); otherwise only the URLs in removed are
+        deleted. Deletes and upserts are committed as one transaction.
+        """
+        now = time.time()
+        with self.lock:
+            if prune:
+                self.db.execute('DELETE FROM pages WHERE domain = ?', (domain,))
+            else:
+                self.db.executemany('DELETE FROM pages WHERE domain = ? AND url = ?',
+                                    [(domain, url) for url in removed])
+            self.db.executemany(
+                'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(domain, url, e['content_hash'], e.get('etag'), e.get('last_modified'),
+                  e['title'], e['text'], json.dumps(e.get('links', []), ensure_ascii=False), now)
+                 for url, e in entries.items()]
+            )
+            self.db.commit()
+
+    # =========================================
+    # ANALYSES
+    # =========================================
+    def load_analysis(self, domain, combined_hash, analysis_key):
+        """Look up the domain's last analysis.
+
+        Returns (result, analyzed_at, content_changed). result is None unless
+        the analysis was made from identical content under the same
+        analysis_key and is younger than analysis_ttl; content_changed
+        compares only the content hash.
+        """
+        with self.lock:
+            row = self.db.execute(
+                'SELECT combined_hash, analysis_key, result, analyzed_at FROM analyses WHERE domain = ?',
+                (domain,)
+            ).fetchone()
+        if row is None:
+            return None, None, True
+        stored_hash, stored_key, result, analyzed_at = row
+        if stored_hash != combined_hash:
+            return None, None, True
+        if stored_key != analysis_key or time.time() - analyzed_at > self.analysis_ttl:
+            return None, None, False
+        return json.loads(result), analyzed_at, False
+
+    def save_analysis(self, domain, combined_hash, analysis_key, result, analyzed_at=None):
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO analyses (domain, combined_hash, result, analyzed_at, analysis_key) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (domain, combined_hash, json.dumps(result, ensure_ascii=False),
+                 analyzed_at or time.time(), analysis_key)
+            )
+            self.db.commit()
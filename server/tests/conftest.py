@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Server modules are imported flat (python app.py is run from server/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
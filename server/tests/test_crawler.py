@@ -0,0 +1,54 @@
+"""
+WebCrawler against a local site whose extra pages are only listed in
+sitemap.xml: sitemap entries count as depth-1 links.
+"""
+
+import functools
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from crawler import WebCrawler
+
+PAGES = {
+    'index.html': ('トップ', '株式会社サンプル工務店のホームページです。'),
+    'company.html': ('会社概要', '会社名 サンプル工務店 設立 1990年 資本金 1000万円'),
+    'works.html': ('施工事例', '注文住宅とリフォームの施工事例を紹介しています。'),
+}
+
+
+@pytest.fixture(scope='module')
+def site(tmp_path_factory):
+    root = tmp_path_factory.mktemp('site')
+    for name, (title, text) in PAGES.items():
+        (root / name).write_text(f'<html><head><title>{title}</title></head>'
+                                 f'<body><p>{text}</p></body></html>', encoding='utf-8')
+    server = ThreadingHTTPServer(('127.0.0.1', 0), None)
+    base = f'http://127.0.0.1:{server.server_port}'
+    (root / 'sitemap.xml').write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        + ''.join(f'<url><loc>{base}/{name}</loc></url>' for name in PAGES)
+        + '</urlset>', encoding='utf-8')
+    handler = type('Handler', (SimpleHTTPRequestHandler,), {'log_message': lambda self, *args: None})
+    server.RequestHandlerClass = functools.partial(handler, directory=str(root))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield base
+    server.shutdown()
+
+
+def test_sitemap_pages_are_crawled_at_depth_one(site):
+    crawler = WebCrawler(max_depth=1)
+    urls = {page['url'] for page in crawler.crawl(f'{site}/index.html')}
+
+    assert urls == {f'{site}/{name}' for name in PAGES}
+    assert crawler.sitemap_urls == 2
+
+
+def test_max_depth_zero_crawls_only_the_start_page(site):
+    crawler = WebCrawler(max_depth=0)
+    pages = crawler.crawl(f'{site}/index.html')
+
+    assert [page['url'] for page in pages] == [f'{site}/index.html']
+    assert crawler.sitemap_urls == 0
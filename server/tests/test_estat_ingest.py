@@ -0,0 +1,141 @@
+"""
+EStatIngest against the local e-Stat stand-in (estat_fixture_server.py):
+NEXT_KEY paging, resuming from the state.json checkpoint, and loading the
+pivoted columns into a municipality store.
+"""
+
+import json
+import os
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import estat_fixture_server
+from estat_fixture_server import FixtureHandler, generate_fixtures, make_page
+from estat_ingest import TABLES, EStatError, EStatIngest
+from municipal_stats import build_store
+
+PAGE_LIMIT = 500
+
+
+@pytest.fixture(scope='module')
+def store(tmp_path_factory):
+    return build_store(str(tmp_path_factory.mktemp('store') / 'municipal_stats.sqlite3'))
+
+
+@pytest.fixture(scope='module')
+def fixture_dir(tmp_path_factory, store):
+    directory = tmp_path_factory.mktemp('fixtures')
+    generate_fixtures(str(directory), store)
+    return directory
+
+
+@pytest.fixture(scope='module')
+def base_url(fixture_dir):
+    handler = type('Handler', (FixtureHandler,), {'fixture_dir': str(fixture_dir),
+                                                  'log_message': lambda self, *args: None})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}{os.path.dirname(estat_fixture_server.API_PATH)}'
+    server.shutdown()
+
+
+def fixture_rows(fixture_dir, name):
+    with open(fixture_dir / f"{TABLES[name]['statsDataId']}.json", encoding='utf-8') as f:
+        response = json.load(f)
+    return response, response['GET_STATS_DATA']['STATISTICAL_DATA']['DATA_INF']['VALUE']
+
+
+def test_make_page_sets_next_key_and_drops_meta(fixture_dir):
+    response, values = fixture_rows(fixture_dir, 'population')
+
+    first = make_page(response, start=1, limit=PAGE_LIMIT)['GET_STATS_DATA']['STATISTICAL_DATA']
+    assert first['RESULT_INF']['NEXT_KEY'] == PAGE_LIMIT + 1
+    assert len(first['DATA_INF']['VALUE']) == PAGE_LIMIT
+    assert 'CLASS_INF' in first
+
+    last_start = (len(values) - 1) // PAGE_LIMIT * PAGE_LIMIT + 1
+    last = make_page(response, start=last_start, limit=PAGE_LIMIT, with_meta=False)
+    last = last['GET_STATS_DATA']['STATISTICAL_DATA']
+    assert 'NEXT_KEY' not in last['RESULT_INF']
+    assert last['RESULT_INF']['TO_NUMBER'] == len(values)
+    assert 'CLASS_INF' not in last and 'TABLE_INF' not in last
+
+
+def test_fetch_follows_next_key(tmp_path, fixture_dir, base_url):
+    _, values = fixture_rows(fixture_dir, 'population')
+    ingest = EStatIngest(app_id='test', output_dir=str(tmp_path), base_url=base_url,
+                         page_limit=PAGE_LIMIT, retries=1)
+
+    state = ingest.fetch_table('population')
+
+    assert state['complete']
+    assert state['rows'] == state['total_number'] == len(values)
+    assert state['pages'] == -(-len(values) // PAGE_LIMIT)
+    assert state['classes']['area']
+
+
+def test_fetch_resumes_from_checkpoint(tmp_path, fixture_dir, base_url):
+    _, values = fixture_rows(fixture_dir, 'construction')
+    ingest = EStatIngest(app_id='test', output_dir=str(tmp_path), base_url=base_url,
+                         page_limit=PAGE_LIMIT, retries=1)
+
+    # Fail on the third page: the first two stay checkpointed
+    fetch_page = ingest._fetch_page
+    starts = []
+
+    def failing_fetch(table, start, path, with_meta):
+        starts.append(start)
+        if len(starts) == 3:
+            raise EStatError('connection lost')
+        return fetch_page(table, start, path, with_meta)
+
+    ingest._fetch_page = failing_fetch
+    with pytest.raises(EStatError):
+        ingest.fetch_table('construction')
+    state = ingest.load_state(TABLES['construction']['statsDataId'])
+    assert (state['pages'], state['complete']) == (2, False)
+    assert state['next_key'] == 2 * PAGE_LIMIT + 1
+
+    # A new run continues at next_key instead of starting over
+    resumed = EStatIngest(app_id='test', output_dir=str(tmp_path), base_url=base_url,
+                          page_limit=PAGE_LIMIT, retries=1)
+    resumed_starts = []
+    resumed_fetch = resumed._fetch_page
+
+    def recording_fetch(table, start, path, with_meta):
+        resumed_starts.append(start)
+        return resumed_fetch(table, start, path, with_meta)
+
+    resumed._fetch_page = recording_fetch
+    state = resumed.fetch_table('construction')
+    assert resumed_starts[0] == 2 * PAGE_LIMIT + 1
+    assert state['complete'] and state['rows'] == len(values)
+
+    dataset = resumed.build_columns('construction')
+    cells = sum(value is not None for column in dataset['columns'].values() for value in column)
+    assert cells == len(values)
+
+
+def test_load_into_store_keeps_fields_the_table_lacks(tmp_path, fixture_dir, base_url, store):
+    _, values = fixture_rows(fixture_dir, 'population')
+    ingest = EStatIngest(app_id='test', output_dir=str(tmp_path), base_url=base_url,
+                         page_limit=PAGE_LIMIT, retries=1)
+    ingest.fetch_table('population')
+    dataset = ingest.build_columns('population')
+
+    seeded = next(r for r in store.by_code.values()
+                  if (r.get('population') or {}).get('age_30_45_pct') is not None)
+    before = dict(seeded['population'])
+    people = next(int(v['$']) for v in values if v['@area'] == seeded['code'] and v['@tab'] == '020')
+
+    updated = ingest.load_into_store('population', dataset, store)
+
+    assert updated == len(store.by_code)
+    after = store.by_code[seeded['code']]['population']
+    assert after['total_population'] == people
+    assert after['age_30_45_pct'] == before['age_30_45_pct']
+    assert after['field_sources']['total_population'].startswith('e-Stat')
+    assert after['field_sources']['age_30_45_pct'] == before['source']
+    assert before['source'] in after['source']
@@ -0,0 +1,55 @@
+"""
+TradeAreaIndex over a store built from the master: a designated city's
+row and its wards must not both be counted in one trade area.
+"""
+
+import pytest
+
+from municipal_stats import build_store
+from trade_area import TradeAreaIndex
+
+# (city, lat, lon, households)
+AREAS = [
+    ('名古屋市', 35.1815, 136.9066, 1_120_000),
+    ('名古屋市天白区', 35.1227, 136.9753, 80_962),
+    ('名古屋市昭和区', 35.1503, 136.9342, 50_000),
+    ('豊田市', 35.0826, 137.1560, 170_000),
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    store = build_store(str(tmp_path / 'municipal_stats.sqlite3'))
+    codes = {city: store.resolve('愛知県', city) for city, _, _, _ in AREAS}
+    store.set_centroids({codes[city]: (lat, lon) for city, lat, lon, _ in AREAS})
+    store.update_many({codes[city]: {'population': {'households': households}}
+                       for city, _, _, households in AREAS})
+    return TradeAreaIndex(store), codes
+
+
+def test_radius_counts_wards_not_their_city(index):
+    index, codes = index
+    result = index.radius(codes['名古屋市天白区'], 10)
+
+    cities = [m['city'] for m in result['municipalities']]
+    assert '名古屋市' not in cities
+    assert set(cities) == {'名古屋市天白区', '名古屋市昭和区'}
+    assert result['totals']['households'] == 80_962 + 50_000
+
+
+def test_city_row_counts_when_none_of_its_wards_is_in_range(index):
+    index, codes = index
+    result = index.radius(codes['名古屋市'], 1)
+
+    assert [m['city'] for m in result['municipalities']] == ['名古屋市']
+    assert result['totals']['households'] == 1_120_000
+
+
+def test_adjacent_drops_the_city_next_to_its_wards(index):
+    index, codes = index
+    index.store.set_adjacency([(codes['名古屋市天白区'], codes['名古屋市昭和区']),
+                               (codes['名古屋市天白区'], codes['名古屋市'])])
+    result = index.adjacent(codes['名古屋市天白区'])
+
+    assert result['neighbour_source'] == 'adjacency'
+    assert result['totals']['households'] == 80_962 + 50_000
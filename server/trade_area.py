@@ -0,0 +1,220 @@
+"""
+不動産市場把握AI - Trade Area Aggregation
+Aggregates market metrics over a builder's 商圏: every municipality whose
+centroid lies within N km of a centre, or a municipality plus its
+neighbours. Centroids and adjacency pairs come from the statistics store
+(python municipal_stats.py centroids / adjacency).
+
+Centroids are bucketed in a uniform grid (cell_km square cells), so a
+radius query only measures the points in the cells the circle touches.
+Without imported adjacency pairs, "adjacent" falls back to the
+fallback_neighbours nearest centroids within fallback_km.
+
+The store keeps a city-level row for each designated city next to its
+wards; when any of its wards is in a trade area the city row is left out,
+so its households are not counted twice.
+"""
+
+import math
+import threading
+
+import numpy as np
+
+from municipal_stats import WARD_RE, get_default_store
+from potential_ranking import as_number, compute_potential
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG_LAT = 111.32
+
+# (category, field) summed or averaged over a trade area
+FIELDS = {
+    'total_population': ('population', 'total_population'),
+    'households': ('population', 'households'),
+    'age_30_45_pct': ('population', 'age_30_45_pct'),
+    'elderly_pct': ('population', 'elderly_pct'),
+    'ownership_rate': ('housing', 'ownership_rate'),
+    'owner_starts': ('construction', 'owner_occupied'),
+    'total_starts': ('construction', 'total'),
+    'total_companies': ('competition', 'total_companies'),
+}
+SUMMED = ['total_population', 'households', 'owner_starts', 'total_starts', 'total_companies']
+HOUSEHOLD_WEIGHTED = ['age_30_45_pct', 'elderly_pct', 'ownership_rate']
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Great-circle distance from one point to arrays of points."""
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class GridIndex:
+    """Uniform lat/lon grid over point indices for radius candidate lookup."""
+
+    def __init__(self, lats, lons, cell_km=10.0):
+        self.lats = lats
+        self.lons = lons
+        self.cell_lat = cell_km / KM_PER_DEG_LAT
+        # Cells are cell_km wide at the southernmost point, wider further north
+        min_lat = float(np.min(np.abs(lats))) if len(lats) else 0.0
+        self.cell_lon = cell_km / (KM_PER_DEG_LAT * math.cos(math.radians(min_lat)))
+        self.cells = {}
+        for i, key in enumerate(zip((lats // self.cell_lat).astype(int).tolist(),
+                                    (lons // self.cell_lon).astype(int).tolist())):
+            self.cells.setdefault(key, []).append(i)
+
+    def within(self, lat, lon, radius_km):
+        """(indices, distances) of points within radius_km of (lat, lon)."""
+        dlat = radius_km / KM_PER_DEG_LAT
+        # Widest longitude span of the circle is at its pole-ward edge
+        edge_lat = min(abs(lat) + dlat, 89.0)
+        dlon = radius_km / (KM_PER_DEG_LAT * math.cos(math.radians(edge_lat)))
+
+        candidates = []
+        for i in range(int((lat - dlat) // self.cell_lat), int((lat + dlat) // self.cell_lat) + 1):
+            for j in range(int((lon - dlon) // self.cell_lon), int((lon + dlon) // self.cell_lon) + 1):
+                candidates.extend(self.cells.get((i, j), ()))
+        if not candidates:
+            return np.array([], dtype=int), np.array([])
+
+        candidates = np.array(candidates)
+        distances = haversine_km(lat, lon, self.lats[candidates], self.lons[candidates])
+        inside = distances <= radius_km
+        return candidates[inside], distances[inside]
+
+
+class TradeAreaIndex:
+    """Metric columns + grid index over municipalities that have centroids."""
+
+    def __init__(self, store, cell_km=10.0, fallback_neighbours=6, fallback_km=20.0):
+        self.store = store
+        self.cell_km = cell_km
+        self.fallback_neighbours = fallback_neighbours
+        self.fallback_km = fallback_km
+        self.lock = threading.Lock()
+        self.version = None
+        self._build()
+
+    def _build(self):
+        records = sorted((r for r in self.store.by_code.values() if r.get('lat') is not None),
+                         key=lambda r: r['code'])
+        self.version = self.store.version
+        self.records = records
+        self.position = {r['code']: i for i, r in enumerate(records)}
+        lats = np.array([r['lat'] for r in records], dtype=float)
+        lons = np.array([r['lon'] for r in records], dtype=float)
+        self.grid = GridIndex(lats, lons, self.cell_km)
+        # Position of each ward's designated city (-1 for everything else)
+        by_name = {(r['prefecture'], r['city']): i for i, r in enumerate(records)}
+        self.parent = np.full(len(records), -1, dtype=int)
+        for i, r in enumerate(records):
+            ward = WARD_RE.match(r['city'])
+            if ward:
+                self.parent[i] = by_name.get((r['prefecture'], ward.group(1)), -1)
+        self.columns = {
+            name: np.array([as_number((r.get(category) or {}).get(field)) for r in records])
+            for name, (category, field) in FIELDS.items()
+        }
+
+    def _refresh(self):
+        with self.lock:
+            if self.version != self.store.version:
+                self._build()
+
+    @property
+    def size(self):
+        self._refresh()
+        return len(self.records)
+
+    def radius(self, code, radius_km):
+        """Aggregate over municipalities within radius_km of code's centroid."""
+        self._refresh()
+        centre = self.records[self._require(code)]
+        members, distances = self.grid.within(centre['lat'], centre['lon'], radius_km)
+        result = self._aggregate(members, distances)
+        result.update({'mode': 'radius', 'radius_km': radius_km})
+        return result
+
+    def adjacent(self, code):
+        """Aggregate over code and its neighbours."""
+        self._refresh()
+        i = self._require(code)
+        centre = self.records[i]
+        neighbours = self.store.adjacency.get(code)
+        if neighbours:
+            members = np.array([i] + sorted(self.position[c] for c in neighbours if c in self.position))
+            source = 'adjacency'
+        else:
+            candidates, distances = self.grid.within(centre['lat'], centre['lon'], self.fallback_km)
+            nearest = candidates[np.argsort(distances, kind='stable')][:self.fallback_neighbours + 1]
+            members = np.union1d([i], nearest)
+            source = 'nearest'
+        distances = haversine_km(centre['lat'], centre['lon'],
+                                 self.grid.lats[members], self.grid.lons[members])
+        result = self._aggregate(members, distances)
+        result.update({'mode': 'adjacent', 'neighbour_source': source})
+        return result
+
+    def _require(self, code):
+        if code not in self.position:
+            raise KeyError(code)
+        return self.position[code]
+
+    def _aggregate(self, members, distances):
+        # A designated city together with its wards: keep the wards only
+        parents = self.parent[members]
+        keep = ~np.isin(members, parents[parents >= 0])
+        members, distances = members[keep], distances[keep]
+
+        order = np.argsort(distances, kind='stable')
+        members, distances = members[order], distances[order]
+        cols = {name: column[members] for name, column in self.columns.items()}
+
+        totals = {}
+        for name in SUMMED:
+            values = cols[name]
+            totals[name] = int(np.nansum(values)) if (~np.isnan(values)).any() else None
+
+        households = cols['households']
+        for name in HOUSEHOLD_WEIGHTED:
+            values = cols[name]
+            usable = ~np.isnan(values) & ~np.isnan(households) & (households > 0)
+            weight = households[usable].sum()
+            totals[name] = round(float((values[usable] * households[usable]).sum() / weight), 1) \
+                if weight else None
+
+        # Same model as a single area, applied to the aggregated trade area
+        potential_input = {
+            'total_population': totals['total_population'], 'households': totals['households'],
+            'age_30_45_pct': totals['age_30_45_pct'], 'ownership_rate': totals['ownership_rate'],
+            'owner_starts': totals['owner_starts'], 'total_companies': totals['total_companies'],
+        }
+        potential = compute_potential({k: np.array([as_number(v)]) for k, v in potential_input.items()})
+
+        return {
+            'municipalities': [
+                {'code': self.records[i]['code'], 'prefecture': self.records[i]['prefecture'],
+                 'city': self.records[i]['city'], 'distance_km': round(float(d), 1)}
+                for i, d in zip(members.tolist(), distances.tolist())
+            ],
+            'count': len(members),
+            'with_households': int((~np.isnan(households)).sum()),
+            'totals': totals,
+            'potential': {k: (None if np.isnan(v[0]) else float(v[0]) if k == 'per_company' else int(v[0]))
+                          for k, v in potential.items()},
+        }
+
+
+_default_index = None
+_default_lock = threading.Lock()
+
+
+def get_default_index():
+    """Process-wide trade-area index over the default municipality store."""
+    global _default_index
+    with _default_lock:
+        if _default_index is None:
+            _default_index = TradeAreaIndex(get_default_store())
+        return _default_index
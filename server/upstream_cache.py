@@ -0,0 +1,155 @@
+"""
+不動産市場把握AI - Upstream Cache
+Process-wide in-memory cache for market-data upstream calls (e-Stat API,
+tochidai.info). Entries are keyed by (source, key), expire after a
+per-source TTL and are evicted least-recently-used once the total size
+passes max_bytes.
+
+Concurrent misses for the same key are coalesced (single-flight): the
+first caller runs the loader, the others wait for its result instead of
+issuing the same upstream request. Failures are not cached; if reloading an
+expired entry fails (e.g. the upstream's circuit breaker is open), the stale
+value is served instead.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds an upstream response stays fresh, per source
+DEFAULT_TTLS = {
+    'estat': 24 * 3600,     # statistics tables change a few times a year
+    'tochidai': 6 * 3600,   # land price pages
+}
+DEFAULT_TTL = 3600
+
+
+class _Flight:
+    """A load in progress that other callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class UpstreamCache:
+    """TTL + LRU cache with single-flight loading and per-source hit ratios."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttls=None, sizeof=len):
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.sizeof = sizeof
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # (source, key) -> (expires_at, size, value)
+        self.flights = {}
+        self.total_bytes = 0
+        self.counters = {}
+
+    def _count(self, source, name):
+        counters = self.counters.setdefault(
+            source, {'hits': 0, 'misses': 0, 'coalesced': 0, 'expired': 0, 'stale_served': 0, 'evictions': 0}
+        )
+        counters[name] += 1
+
+    def get_or_load(self, source, key, loader):
+        """Return the cached value for (source, key), calling loader() on a miss."""
+        cache_key = (source, key)
+        stale = None
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is not None:
+                if entry[0] > time.time():
+                    self.entries.move_to_end(cache_key)
+                    self._count(source, 'hits')
+                    return entry[2]
+                stale = entry  # kept until replaced or evicted
+                self._count(source, 'expired')
+
+            flight = self.flights.get(cache_key)
+            if flight is not None:
+                self._count(source, 'coalesced')
+                leader = False
+            else:
+                flight = self.flights[cache_key] = _Flight()
+                self._count(source, 'misses')
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except Exception as e:
+            if stale is not None:
+                with self.lock:
+                    self._count(source, 'stale_served')
+                flight.value = stale[2]
+                return flight.value
+            flight.error = e
+            raise
+        else:
+            self._put(cache_key, flight.value)
+            return flight.value
+        finally:
+            with self.lock:
+                self.flights.pop(cache_key, None)
+            flight.done.set()
+
+    def _put(self, cache_key, value):
+        size = self.sizeof(value) if value is not None else 0
+        if size > self.max_bytes:
+            return
+        ttl = self.ttls.get(cache_key[0], DEFAULT_TTL)
+        with self.lock:
+            if cache_key in self.entries:
+                self._drop(cache_key)
+            self.entries[cache_key] = (time.time() + ttl, size, value)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._drop(oldest)
+                self._count(oldest[0], 'evictions')
+
+    def _drop(self, cache_key):
+        _, size, _ = self.entries.pop(cache_key)
+        self.total_bytes -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        """Per-source counters and hit ratio (coalesced waits count as hits)."""
+        with self.lock:
+            sources = {}
+            for source, c in self.counters.items():
+                lookups = c['hits'] + c['coalesced'] + c['misses']
+                served = c['hits'] + c['coalesced']
+                sources[source] = dict(c, hit_ratio=round(served / lookups, 3) if lookups else None)
+            return {
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'sources': sources,
+            }
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_default_cache():
+    """Process-wide cache shared by every MarketDataFetcher."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = UpstreamCache(
+                max_bytes=int(os.environ.get('UPSTREAM_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+            )
+        return _default_cache